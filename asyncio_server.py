@@ -0,0 +1,212 @@
+'''
+Asyncio server, an alternative to the WaferSlimServer that is started with
+the --async option (python 3.7+ only).
+
+Rather than handling a single connection and then shutting down, the
+AsyncSlimServer stays up and serves any number of concurrent Slim sessions
+from one long-lived process, so interpreter startup and fixture imports are
+not paid again for every test page (see also the --persistent option).
+Socket I/O for every session is handled on the event loop; each session has
+its own ExecutionContext, and its (blocking) fixture code is run on a worker
+thread dedicated to that session. At most --threads sessions execute fixture
+code at the same time.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import asyncio
+import logging
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from . import instrumentation, protocol
+from .execution import ExecutionContext, FixtureCache, Instructions, Results
+from .server import _LOGGER_NAME, _setup_verbosity
+
+_DEFAULT_THREADS = 8
+_STOP_TIMEOUT = 5
+
+
+class AsyncSlimServer(object):
+    ''' Long-lived server handling each connection as a separate Slim session
+    on an asyncio event loop '''
+
+    def __init__(self, options,
+                 instructions=Instructions,
+                 execution_context=None,
+                 results=Results):
+        ''' Initialise server for host and port, with logging. Unless an
+        execution_context factory is specified, all sessions share one
+        FixtureCache - as with the --persistent WaferSlimServer. '''
+        _setup_verbosity(options)
+        self._logger = logging.getLogger(_LOGGER_NAME)
+        self._address = (options.inethost, int(options.port))
+        self._threads = getattr(options, 'threads', None) or _DEFAULT_THREADS
+        self._instructions = instructions
+        self.fixture_cache = FixtureCache()
+        self.instrument = (getattr(options, 'instrument', ''),
+                           getattr(options, 'profile', ''))
+        self.typed_symbols = getattr(options, 'typed_symbols', False)
+        self._execution_context = execution_context \
+                                  or self.new_execution_context
+        self._results = results
+        self._loop = None
+        # created by serve(), on the event loop: before 3.10 asyncio's
+        # Event and Semaphore are bound to the loop current on creation
+        self._stopping = None
+        self._slots = None
+        self._sessions = {}
+        self.started = threading.Event()
+        self.server_address = None
+        prestart_msg = "Starting async server with options: %s" % (options,)
+        self._logger.info(prestart_msg)
+
+    def new_execution_context(self):
+        ''' Create the ExecutionContext for a new session '''
+        return ExecutionContext(
+            fixture_cache=self.fixture_cache,
+            instrumentation=instrumentation.for_session(*self.instrument),
+            typed_symbols=self.typed_symbols)
+
+    def serve_forever(self):
+        ''' Run the event loop and serve sessions until stop() is called '''
+        asyncio.run(self.serve())
+
+    def stop(self):
+        ''' Stop serving - may be called from any thread '''
+        if self._loop is not None:
+            self._loop.call_soon_threadsafe(self._stopping.set)
+
+    async def serve(self):
+        ''' Coroutine to serve sessions until stop() is called '''
+        self._loop = asyncio.get_running_loop()
+        self._stopping = asyncio.Event()
+        self._slots = asyncio.Semaphore(self._threads)
+        server = await asyncio.start_server(self._handle_session,
+                                            *self._address)
+        self.server_address = server.sockets[0].getsockname()[:2]
+        self._logger.info("Started and listening on %s:%s" %
+                          self.server_address)
+        self.started.set()
+        try:
+            await self._stopping.wait()
+        finally:
+            self._logger.info('Shutting down')
+            server.close()
+            await self._close_sessions()
+            await server.wait_closed()
+
+    async def _close_sessions(self):
+        ''' Close the connection of every active session, then wait for the
+        sessions to end - cancelling any still running after _STOP_TIMEOUT '''
+        sessions = dict(self._sessions)
+        if not sessions:
+            return
+        for writer in sessions.values():
+            writer.close()
+        done, running = await asyncio.wait(list(sessions.keys()),
+                                           timeout=_STOP_TIMEOUT)
+        for session in running:
+            session.cancel()
+        if running:
+            await asyncio.wait(running)
+
+    async def _handle_session(self, reader, writer):
+        ''' Handle one connection as a complete Slim session '''
+        from_addr = '%s:%s' % writer.get_extra_info('peername')[:2]
+        self._logger.info('Handling request from %s' % from_addr)
+        session = asyncio.current_task()
+        self._sessions[session] = writer
+        executor = ThreadPoolExecutor(max_workers=1)
+        try:
+            received, sent = await self._respond_to_request(reader, writer,
+                                                            executor)
+            done_msg = 'Done with %s: %s bytes received, %s bytes sent'
+            self._logger.info(done_msg % (from_addr, received, sent))
+        except (asyncio.IncompleteReadError, ConnectionError):
+            self._logger.info('Connection closed by %s' % from_addr)
+        except asyncio.CancelledError:
+            self._logger.info('Session with %s cancelled' % from_addr)
+            raise
+        except Exception as error:
+            logging.error(error, exc_info=1)
+        finally:
+            del self._sessions[session]
+            executor.shutdown(wait=False)
+            writer.close()
+            try:
+                await writer.wait_closed()
+            except Exception:  # the connection was already broken
+                pass
+
+    async def _respond_to_request(self, reader, writer, executor):
+        ''' The asyncio equivalent of RequestResponder.respond_to_request '''
+        encoding = protocol.BYTE_ENCODING
+        ack = protocol._VERSION.encode(encoding)
+        writer.write(ack)
+        await writer.drain()
+        received, sent = 0, len(ack)
+
+        context = await self._run(executor, self._execution_context)
+        header_size = len(((protocol._NUMERIC_ENCODING % 0) +
+                           protocol._SEPARATOR).encode(encoding))
+        disconnect = protocol._DISCONNECT.encode(encoding)
+        instruments = getattr(context, 'instrumentation', None)
+        try:
+            while True:
+                header = await reader.readexactly(header_size)
+                if instruments is not None:
+                    since = instruments.mark()
+                message_length = int(header[0:protocol._NUMERIC_LENGTH])
+                message = await reader.readexactly(message_length)
+                received += header_size + message_length
+                if disconnect == message:
+                    break
+                if instruments is not None:
+                    instruments.phase('recv', since,
+                                      header_size + message_length)
+
+                response = await self._run(executor,
+                                           self._respond_to_message,
+                                           message, context)
+                if instruments is not None:
+                    since = instruments.mark()
+                writer.write(response)
+                await writer.drain()
+                sent += len(response)
+                if instruments is not None:
+                    instruments.phase('send', since, len(response))
+        finally:
+            # shielded, so the session is ended even if this is cancelled
+            await asyncio.shield(self._run(executor, self._end_session,
+                                           context))
+        return received, sent
+
+    def _end_session(self, context):
+        ''' Report on and close the context of an ended session (on its
+        worker thread) '''
+        instruments = getattr(context, 'instrumentation', None)
+        try:
+            if instruments is not None:
+                instruments.session_ended()
+        finally:
+            if hasattr(context, 'close'):
+                context.close()
+
+    async def _run(self, executor, function, *args):
+        ''' Run (blocking) function on the session's own worker thread,
+        waiting for one of the execution slots to become free first '''
+        async with self._slots:
+            return await self._loop.run_in_executor(executor, function, *args)
+
+    def _respond_to_message(self, message, context):
+        ''' Execute the message and pack its results (on a worker thread) '''
+        results = protocol.execute_message(message, self._instructions,
+                                           context, self._results)
+        instruments = getattr(context, 'instrumentation', None)
+        if instruments is None:
+            return protocol.pack_message(results)
+        since = instruments.mark()
+        response = protocol.pack_message(results)
+        instruments.phase('pack', since, len(response))
+        return response
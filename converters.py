@@ -20,32 +20,54 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 
 Copyright 2009-2010 by the author(s). All rights reserved
 '''
-import datetime, threading
+import datetime, re, threading
+from six import class_types, string_types
+from six.moves import zip
 from .slim_exceptions import WaferSlimException
 
 __THREADLOCAL = threading.local()
 
-class _ReIterable(object):
-    ''' Class to allow repeatable iteration over to_type / using converters '''
-    def __init__(self, underlying):
-        ''' Specify the iterable for repeatable iteration '''
-        self._underlying = underlying
-    def reset(self, num_params):
-        ''' Reset iteration and note num_params supplied in method call '''
-        self._num_params = num_params
+class _ConversionPlans(object):
+    ''' The converter to use for each of a number of params, from the to_type
+    / using converters: either a single converter for every param, or one per
+    param position. Each is planned as a (converter, to_type) pair, with the
+    declared to_type (if any) for the position, since converters are held per
+    thread and so cannot themselves identify the type they convert to.
+    Per-position plans are compiled once for each number of params and then
+    only read, so may be shared between threads. '''
+    __slots__ = ('single', '_converters', '_plans')
+
+    def __init__(self, converters, to_types=None):
+        ''' Specify the (single or iterable) converters, and optionally the
+        (single or tuple of) declared types they convert to '''
         try:
-            self._iterator = iter(self._underlying)
+            converters = tuple(converters)
         except TypeError:
-            self._iterator = None
-        return True
-    def next(self):
-        ''' Get next value from the iterable '''
+            self._converters = None
+            self.single = (converters, to_types)
+        else:
+            if type(to_types) is not tuple:
+                to_types = (None,) * len(converters)
+            self._converters = tuple(zip(converters, to_types))
+            self.single = None
+        self._plans = {}
+
+    def plan_for(self, num_params):
+        ''' Get the tuple of (converter, to_type) for num_params params '''
         try:
-            return self._iterator and next(self._iterator) or self._underlying
-        except StopIteration:
+            return self._plans[num_params]
+        except KeyError:
+            pass
+        if self.single is not None:
+            plan = (self.single,) * num_params
+        elif num_params > len(self._converters):
             msg = '%s to_type or using args insufficient to convert %s params'
-            raise WaferSlimException(msg % (len(self._underlying),
-                                            self._num_params))
+            raise WaferSlimException(msg % (len(self._converters),
+                                            num_params))
+        else:
+            plan = self._converters[:num_params]
+        self._plans[num_params] = plan
+        return plan
 
 class TableTableConstants(object):
     ''' String constants for returning results from a TableTable '''
@@ -79,7 +101,7 @@ class Converter(object):
 
     def to_string(self, value):
         ''' Use default str() to convert from a value into a string '''
-        if isinstance(value, str) or isinstance(value, unicode):
+        if isinstance(value, string_types):
             return value
         return str(value)
 
@@ -133,14 +155,32 @@ class FromConstructorConverter(Converter):
         ''' Delegate to the type(str) constructor to perform the conversion '''
         return self._type(value)
 
+_ISO_DATE = r'([0-9]{4})-([0-9]{2})-([0-9]{2})'
+_ISO_TIME = r'([0-9]{2}):([0-9]{2}):([0-9]{2})(?:\.([0-9]{1,6}))?'
+
+def _microseconds(fraction):
+    ''' Convert the (optional, 1-6 digit) fraction of a second to int '''
+    return fraction and int(fraction.ljust(6, '0')) or 0
+
 class DateConverter(Converter):
     ''' Converter to/from datetime.date type via iso-standard format
-    (4digityear-2digitmonth-2digitday, e.g. 2009-02-28) '''
+    (4digityear-2digitmonth-2digitday, e.g. 2009-02-28).
+    Strictly iso-standard values are parsed directly; any others are parsed
+    (more slowly) with strptime() and DATE_FORMAT. '''
 
     DATE_FORMAT = '%Y-%m-%d'
+    _ISO_FORMAT = re.compile(_ISO_DATE + r'\Z')
+
+    def to_string(self, value):
+        ''' Generate iso-standard format str from datetime.date '''
+        return value.isoformat()
 
     def from_string(self, value):
         ''' Generate datetime.date from iso-standard format str '''
+        match = DateConverter._ISO_FORMAT.match(value)
+        if match:
+            year, month, day = match.groups()
+            return datetime.date(int(year), int(month), int(day))
         return datetime.datetime.strptime(value,
                                           DateConverter.DATE_FORMAT).date()
 
@@ -148,13 +188,25 @@ class TimeConverter(Converter):
     ''' Converter to/from datetime.date type via iso-standard format
     (2digithour:2digitminute:2digitsecond - with or without
     an additional optional .6digitmillis, e.g. 01:02:03 or 01:02:03.456789).
-    Does not take any time-zone UTC offset into account!'''
+    Does not take any time-zone UTC offset into account!
+    Strictly iso-standard values are parsed directly; any others are parsed
+    (more slowly) with strptime() and the TIME_FORMATs. '''
 
     TIME_FORMAT_WITHOUT_MICROSECONDS = '%H:%M:%S'
     TIME_FORMAT_WITH_MICROSECONDS = TIME_FORMAT_WITHOUT_MICROSECONDS + '.%f'
+    _ISO_FORMAT = re.compile(_ISO_TIME + r'\Z')
+
+    def to_string(self, value):
+        ''' Generate iso-standard format str from datetime.time '''
+        return value.isoformat()
 
     def from_string(self, value):
         ''' Generate datetime.time from formatted str '''
+        match = TimeConverter._ISO_FORMAT.match(value)
+        if match:
+            hour, minute, second, fraction = match.groups()
+            return datetime.time(int(hour), int(minute), int(second),
+                                 _microseconds(fraction))
         try:
             return datetime.datetime.strptime(value,
                 TimeConverter.TIME_FORMAT_WITH_MICROSECONDS).time()
@@ -164,15 +216,28 @@ class TimeConverter(Converter):
 
 class DatetimeConverter(Converter):
     ''' Converter to/from datetime.datetime type via iso-standard formats
-    ("dateformat<space>timeformat", e.g. "2009-02-28 21:54:32.987654"). '''
+    ("dateformat<space>timeformat", e.g. "2009-02-28 21:54:32.987654").
+    Strictly iso-standard values are parsed directly; any others are parsed
+    (more slowly) with strptime() and the FORMATs. '''
 
     FORMAT_WITH_MICROSECONDS = '%s %s' % (DateConverter.DATE_FORMAT,
                                 TimeConverter.TIME_FORMAT_WITH_MICROSECONDS)
     FORMAT_WITHOUT_MICROSECONDS = '%s %s' % (DateConverter.DATE_FORMAT,
                                 TimeConverter.TIME_FORMAT_WITHOUT_MICROSECONDS)
+    _ISO_FORMAT = re.compile(r'%s %s\Z' % (_ISO_DATE, _ISO_TIME))
+
+    def to_string(self, value):
+        ''' Generate iso-standard format str from datetime.datetime '''
+        return value.isoformat(' ')
 
     def from_string(self, value):
         ''' Generate a datetime.datetime from a str '''
+        match = DatetimeConverter._ISO_FORMAT.match(value)
+        if match:
+            year, month, day, hour, minute, second, fraction = match.groups()
+            return datetime.datetime(int(year), int(month), int(day),
+                                     int(hour), int(minute), int(second),
+                                     _microseconds(fraction))
         try:
             return datetime.datetime.strptime(value,
                                 DatetimeConverter.FORMAT_WITH_MICROSECONDS)
@@ -199,13 +264,27 @@ class IterableConverter(Converter):
             converters = _converters_for(to_type)
         else:
             converters = _strict_converter_for(to_type)
-        self._converters = _ReIterable(converters)
+        self._converters = _ConversionPlans(converters)
+        self._bulk_from_string = self._converters.single is not None \
+                                 and _bulk_from_string(converters) or None
 
     def to_string(self, iterable_values):
         ''' Generate a list of str values from a list of typed values.
         Note the slightly misleading name of this method: it actually returns
-        a list (of str) rather than an actual str...'''
-        return [to_string(value) for value in iterable_values]
+        a list (of str) rather than an actual str...
+        The converter for each value is only looked up again when the type of
+        value changes, so is looked up just once for a list of one type.'''
+        strings = []
+        append = strings.append
+        value_type = convert = None
+        is_class = False
+        for value in iterable_values:
+            if type(value) is not value_type or is_class:
+                value_type = type(value)
+                is_class = isinstance(value, class_types)
+                convert = _bulk_to_string(converter_for(value), value_type)
+            append(convert(value))
+        return strings
 
     def from_string(self, value):
         ''' Generate a tuple from a str.
@@ -218,18 +297,76 @@ class IterableConverter(Converter):
         if value.startswith('[') and value.endswith(']'):
             return self.from_string(value[1:len(value)-1])
         items = value.split(',')
-        self._converters.reset(len(items))
-        return tuple([self._convert(item.strip()) for item in items])
-
-    def _convert(self, item):
-        ''' Perform the actual conversion of an item '''
-        return self._converters.next().from_string(item)
+        if self._bulk_from_string is not None:
+            return self._bulk_from_string(items)
+        plan = self._converters.plan_for(len(items))
+        return tuple([converter.from_string(item.strip())
+                      for (converter, _), item in zip(plan, items)])
+
+def _bulk_to_string(converter, value_type):
+    ''' Get the function to convert values of value_type to str with
+    converter - str() itself, for the standard int and float converters '''
+    if type(converter) is FromConstructorConverter \
+    and not issubclass(value_type, string_types):
+        return str
+    return converter.to_string
+
+def _bulk_from_string(converter):
+    ''' Get a function to convert a list of (unstripped) str items to a
+    tuple of values with a single converter - in bulk, without a method call
+    per item, for the standard int, float, bool and str converters '''
+    converter_type = type(converter)
+    if converter_type is FromConstructorConverter \
+    and converter._type in (int, float):
+        # int() and float() ignore surrounding whitespace themselves
+        return lambda items: tuple(map(converter._type, items))
+    if converter_type is TrueFalseConverter:
+        return lambda items: tuple([item.strip().lower() == 'true'
+                                    for item in items])
+    if converter_type is StrConverter:
+        return lambda items: tuple([item.strip() for item in items])
+    from_string = converter.from_string
+    return lambda items: tuple([from_string(item.strip()) for item in items])
 
 class _MarkupHashTableParser(object):
-    ''' Subclass HTMLParser to extract name-value pairs from an html table '''
+    ''' Extract name-value pairs from an html table, in a single pass over
+    its table, tr and td tags. The markup in each cell is kept as-is (only
+    stripped of surrounding whitespace): in particular, a nested table in a
+    value cell is left as markup, to be converted in turn if required. '''
+    _TAG = re.compile(r'<(/?)(table|tr|td)\b[^>]*>', re.I)
+
     def to_dict(self, markup):
-        '''I broke it, because I don't understand why it is needed'''
-        return self._dict
+        ''' Get the dict of name-value (str) pairs in the outermost table
+        of markup, from each of its rows with (at least) 2 cells '''
+        a_dict = {}
+        depth = 0
+        cells = []
+        cell_start = None
+        for tag in _MarkupHashTableParser._TAG.finditer(markup):
+            closing, name = tag.group(1), tag.group(2).lower()
+            if name == 'table':
+                if not closing:
+                    depth += 1
+                    continue
+                depth -= 1
+                if depth > 0:
+                    continue
+            elif depth != 1:
+                continue
+            elif name == 'td':
+                if not closing:
+                    cell_start = tag.end()
+                elif cell_start is not None:
+                    cells.append(markup[cell_start:tag.start()].strip())
+                    cell_start = None
+                continue
+            if len(cells) >= 2:
+                a_dict[cells[0]] = cells[1]
+            cells = []
+            cell_start = None
+            if depth <= 0:
+                break
+        return a_dict
 
 class DictConverter(Converter):
     ''' Converter to/from dict type via slim-table format
@@ -254,17 +391,19 @@ class DictConverter(Converter):
     def to_string(self, a_dict):
         ''' Generate a str value in the fitnesse HashMarkupTable format
         from a dict of typed name,value pairs '''
-        names = [key for key in a_dict.keys()]
-        names.sort()
-        rows = ['<tr %s><td %s>%s</td><td %s>%s</td></tr>' \
-                % (DictConverter.TR_CLASS,
-                   DictConverter.TD_KEY_CLASS,
-                   to_string(name),
-                   DictConverter.TD_VALUE_CLASS,
-                   to_string(a_dict.get(name)))
-                for name in names]
-        return '<table %s>%s</table>' % \
-                (DictConverter.TABLE_CLASS, ''.join(rows))
+        row_start = '<tr %s><td %s>' % (DictConverter.TR_CLASS,
+                                         DictConverter.TD_KEY_CLASS)
+        row_middle = '</td><td %s>' % DictConverter.TD_VALUE_CLASS
+        buffer = ['<table %s>' % DictConverter.TABLE_CLASS]
+        write = buffer.append
+        for name in sorted(a_dict.keys()):
+            write(row_start)
+            write(_as_str(to_string(name)))
+            write(row_middle)
+            write(_as_str(to_string(a_dict[name])))
+            write('</td></tr>')
+        write('</table>')
+        return ''.join(buffer)
 
     def from_string(self, hash_table_markup):
         ''' Generate a dict of typed name,value pairs from a str value
@@ -281,6 +420,12 @@ class DictConverter(Converter):
                 a_dict[key] = from_string(a_dict[key], to_type_or_using)
         return a_dict
 
+def _as_str(value):
+    ''' Format value (as converted with to_string) to write in markup '''
+    if isinstance(value, string_types):
+        return value
+    return '%s' % (value,)
+
 def register_converter(for_type, converter_instance):
     ''' Register a converter_instance to be used with all for_type instances.
     Registration is 'forever' (across all fitnesse tables run as a suite): the
@@ -291,15 +436,30 @@ def register_converter(for_type, converter_instance):
     hasattr(converter_instance, 'to_string'):
         __init_converters()
         __THREADLOCAL.converters[for_type] = converter_instance
+        __THREADLOCAL.resolved = {}
         return
     msg = 'Converter for %s requires from_string() and to_string()' % for_type
     raise TypeError(msg)
 
+def registered_converters():
+    ''' Get the converters registered for the current thread, e.g. to
+    use_converters() in a worker thread doing work for it '''
+    __init_converters()
+    return __THREADLOCAL.converters
+
+def use_converters(converters):
+    ''' Use the converters registered for another thread (as from
+    registered_converters()) in the current thread '''
+    __THREADLOCAL.converters = converters
+    __THREADLOCAL.resolved = {}
+
 def __init_converters():
     ''' Ensure standard converters exist for bool, int, float, datetime, ...
     All registered converters, keyed on type, are held as thread-local to
     ensure that ExecutionContext-s (which are created per thread by the
-    server) really are isolated from each other'''
+    server) really are isolated from each other - as are the converters
+    resolved for each type by converter_for(), which are discarded whenever
+    another converter is registered'''
     if hasattr(__THREADLOCAL, 'converters'):
         return
 
@@ -347,17 +507,59 @@ def convert_arg(to_type=None, using=None):
             converter = using and using or _converters_for(to_type)
         else:
             converter = using and using or _strict_converter_for(to_type)
-        reiterable = _ReIterable(converter)
-        _reset = reiterable.reset
-        _next = reiterable.next
+        plans = _ConversionPlans(converter, not using and to_type or None)
+        compiled, plan_for = plans._plans, plans.plan_for
         def convert_args_and_return_result(self, *args):
             ''' callable that delegates to the decorated fn '''
-            _reset(len(args))
-            return base_fn(self,
-                    *tuple([_next().from_string(arg) for arg in args]))
+            plan = compiled.get(len(args)) or plan_for(len(args))
+            return base_fn(self, *[
+                converter.from_string(arg) if type(arg) is not TypedSymbol
+                else arg.convert(converter, _type)
+                for (converter, _type), arg in zip(plan, args)])
+        convert_args_and_return_result.typed_symbols = True
         return convert_args_and_return_result
     return conversion_decorator
 
+class TypedSymbol(object):
+    ''' The value assigned to a symbol in typed symbol mode (see
+    ExecutionContext), as passed to methods decorated with convert_arg.
+    Where the arg is declared (with to_type) as the type of the value, the
+    value itself is passed on without any conversion (note: it is not
+    copied); otherwise its string form is converted. '''
+    __slots__ = ('value', '_converted', '_string')
+
+    def __init__(self, value):
+        ''' Specify the (typed) value of the symbol '''
+        self.value = value
+        self._converted = self._string = None
+
+    def converted(self):
+        ''' Get the value as converted with to_string (so a list of str, for
+        an iterable value), converted when first needed '''
+        if self._converted is None:
+            self._converted = to_string(self.value)
+        return self._converted
+
+    def string(self):
+        ''' Get the value as a single str, in the form that from_string
+        reads back: an iterable value is written as "[item, item, ...]" '''
+        if self._string is None:
+            self._string = _joined(self.converted())
+        return self._string
+
+    def convert(self, converter, to_type=None):
+        ''' Get the value as it would be converted by converter, to to_type '''
+        if to_type is not None and type(self.value) is to_type:
+            return self.value
+        return converter.from_string(self.string())
+
+def _joined(value):
+    ''' Join a (possibly nested) list of str, as converted with to_string,
+    into a single str '''
+    if isinstance(value, string_types):
+        return value
+    return '[%s]' % ', '.join([_joined(item) for item in value])
+
 def convert_result(using):
     ''' Method decorator to convert a method result from a python datatype
     using a specific converter. The argument "using" is required.
@@ -375,12 +577,32 @@ def convert_result(using):
 
 def converter_for(type_or_value):
     ''' Returns the appropriate converter for a particular type_or_value.
-    This will be a registered type-specific converter if one exists,
-    otherwise the default (base Converter).'''
+    This will be the converter registered for the type or, failing that, for
+    the nearest of its base classes if one exists, otherwise the default
+    (base Converter). The converter resolved for each type is cached.'''
+    try:
+        resolved = __THREADLOCAL.resolved
+    except AttributeError:
+        __init_converters()
+        resolved = __THREADLOCAL.resolved
+    if isinstance(type_or_value, class_types):
+        _type = type_or_value
+    else:
+        _type = type(type_or_value)
     try:
-        return _strict_converter_for(type_or_value)
+        return resolved[_type]
     except KeyError:
-        return _DEFAULT_CONVERTER
+        converter = resolved[_type] = _resolve_converter(_type)
+        return converter
+
+def _resolve_converter(_type):
+    ''' Find the converter registered for _type or the nearest of its base
+    classes (in method resolution order), or else the default converter '''
+    converters = __THREADLOCAL.converters
+    for base in getattr(_type, '__mro__', (_type,)):
+        if base in converters:
+            return converters[base]
+    return _DEFAULT_CONVERTER
 
 def to_string(value, using=None):
     ''' Shortcut for converter_for(value).to_string(value) or
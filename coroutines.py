@@ -0,0 +1,85 @@
+'''
+Support for fixture methods that are coroutine functions (python 3.5+).
+
+A Call of such a method is run to completion on the event loop of the
+session's ExecutionContext, so that fixtures using asyncio clients can keep
+their connections open across calls. Consecutive Call-s of coroutine
+functions within a message are gathered, to run concurrently on that event
+loop, except where one depends on another (see _CallDependencies).
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import asyncio
+from inspect import iscoroutine
+from .execution import _CallDependencies, _debug
+
+
+class CoroutineCalls(object):
+    ''' Gathers Call-s of coroutine functions, each awaiting the Call-s that
+    it depends on, and runs them on the session's event loop. Results are
+    collected in the original order. '''
+
+    def __init__(self, instructions, execution_context):
+        ''' Provide the Instructions that the Call-s are executed for '''
+        self._instructions = instructions
+        self._execution_context = execution_context
+        self._submitted = []
+
+    def submit(self, instruction, results):
+        ''' Add a Call, collecting its results in a deferred Results '''
+        self._submitted.append((instruction, results.deferred()))
+
+    def complete(self, results):
+        ''' Run all submitted Call-s to completion, and include their results
+        in order. Return False if one of them stopped the test, in which case
+        the results of later Call-s are discarded '''
+        submitted, self._submitted = self._submitted, []
+        outcomes = self._execution_context.run_coroutine(
+            self._gather(submitted))
+        for (_, deferred), carry_on in zip(submitted, outcomes):
+            results.include(deferred)
+            if not carry_on:
+                return False
+        return True
+
+    def shutdown(self):
+        ''' Nothing to release: the event loop belongs to the session '''
+        pass
+
+    async def _gather(self, submitted):
+        ''' Coroutine to run the Call-s concurrently '''
+        dependencies = _CallDependencies()
+        tasks = []
+        for instruction, deferred in submitted:
+            depends_on = dependencies.of(instruction)
+            task = asyncio.ensure_future(
+                self._execute_after(depends_on, instruction, deferred))
+            dependencies.add(instruction, task)
+            tasks.append(task)
+        return await asyncio.gather(*tasks)
+
+    async def _execute_after(self, depends_on, instruction, results):
+        ''' Coroutine equivalent of Instructions._execute, executing the Call
+        once the Call-s it depends on are done '''
+        if depends_on:
+            await asyncio.wait(depends_on)
+        if self._instructions._debugging:
+            _debug(self._instructions._logger, 'Executing %r', instruction)
+        context = self._execution_context
+        instrumentation = getattr(context, 'instrumentation', None)
+        if instrumentation is not None:
+            since = instrumentation.mark()
+        try:
+            result, is_ok = instruction.invoke(context, results)
+            if is_ok:
+                if iscoroutine(result):
+                    result = await result
+                instruction.complete(context, results, result)
+        except Exception as error:
+            return self._instructions._failed(instruction, error, results)
+        finally:
+            if instrumentation is not None:
+                instrumentation.instruction(instruction, context, since)
+        return True
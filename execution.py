@@ -7,16 +7,33 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 
 Copyright 2009-2010 by the author(s). All rights reserved
 '''
+import json
 import os
 import re
 import sys
 import logging
+import threading
+import types
+from six.moves import zip
+try:
+    from functools import lru_cache
+except ImportError:  # only introduced in 3.2
+    lru_cache = None
+try:
+    from concurrent.futures import ThreadPoolExecutor, wait
+except ImportError:  # py2 without the futures backport: no parallel calls
+    ThreadPoolExecutor = None
+try:
+    from inspect import iscoroutinefunction
+except ImportError:  # no coroutines before py3.5
+    iscoroutinefunction = None
 from .instructions import (Instruction,
                            Make,
                            Call,
                            CallAndAssign,
                            Import)
-from .converters import to_string
+from .converters import (to_string, TypedSymbol, registered_converters,
+                         use_converters)
 
 _OK = 'OK'
 _EXCEPTION = '__EXCEPTION__:'
@@ -25,37 +42,93 @@ _NONE_STRING = '/__VOID__/'
 
 
 class Results(object):
-    ''' Collecting parameter for results of Instruction execute() methods '''
+    ''' Collecting parameter for results of Instruction execute() methods.
+    The ids and (string) results are collected in two parallel lists, rather
+    than as a list for each result. '''
+    __slots__ = ('_ids', '_values', '_convert_to_string')
     NO_RESULT_EXPECTED = object()
 
     def __init__(self, convert_to_string=to_string):
-        ''' Set up the list to hold the collected results and obtain the
+        ''' Set up the lists to hold the collected results and obtain the
         currently registered type converters '''
-        self._collected = []
+        self._ids = []
+        self._values = []
         self._convert_to_string = convert_to_string
 
     def completed(self, instruction, result=NO_RESULT_EXPECTED):
         ''' An instruction has completed, perhaps with a result '''
-        if result == Results.NO_RESULT_EXPECTED:
+        if result is Results.NO_RESULT_EXPECTED:
             str_result = _OK
         elif result is None:
             str_result = _NONE_STRING
         else:
             str_result = self._convert_to_string(result)
-        self._collected.append([instruction.instruction_id(), str_result])
+        self._collect(instruction.instruction_id(), str_result)
 
     def failed(self, instruction, cause, stop_test=False):
         ''' An instruction has failed due to some underlying cause '''
         failed_type = stop_test and _STOP_TEST or _EXCEPTION
-        self._collected.append([instruction.instruction_id(),
-                                '%s message:<<%s>>' % (failed_type, cause)])
+        self._collect(instruction.instruction_id(),
+                      '%s message:<<%s>>' % (failed_type, cause))
+
+    def _collect(self, instruction_id, str_result):
+        ''' Collect the (string) result of an instruction '''
+        self._ids.append(instruction_id)
+        self._values.append(str_result)
 
     def collection(self):
         ''' Get the collected list of results - modifications to the list
         will not be reflected in this collection '''
-        collected = []
-        collected.extend(self._collected)
-        return collected
+        return [[instruction_id, value]
+                for instruction_id, value in zip(self._ids, self._values)]
+
+    def view(self):
+        ''' Get a read-only view of the collected results, without copying
+        them: an (id, result) tuple is only created for each result as the
+        view is iterated, e.g. as it is packed into a response '''
+        return ResultsView(self._ids, self._values)
+
+    def deferred(self):
+        ''' Get a new, empty Results to collect results (e.g. from another
+        thread) that will be included in this one later on '''
+        return Results(self._convert_to_string)
+
+    def include(self, deferred):
+        ''' Include the results collected by a deferred() Results '''
+        self._ids.extend(deferred._ids)
+        self._values.extend(deferred._values)
+
+
+class ResultsView(object):
+    ''' Read-only sequence of the (id, result) tuples of a Results '''
+    __slots__ = ('_ids', '_values')
+
+    def __init__(self, ids, values):
+        ''' Provide the parallel lists of ids and results '''
+        self._ids = ids
+        self._values = values
+
+    def __len__(self):
+        return len(self._ids)
+
+    def __iter__(self):
+        return iter(zip(self._ids, self._values))
+
+    def __getitem__(self, index):
+        return (self._ids[index], self._values[index])
+
+    def __eq__(self, other):
+        try:
+            return list(map(list, self)) == [list(item) for item in other]
+        except TypeError:
+            return False
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return repr(list(map(list, self)))
+
 
 _INSTRUCTION_TYPES = {'make': Make,
                       'import': Import,
@@ -63,26 +136,54 @@ _INSTRUCTION_TYPES = {'make': Make,
                       'callAndAssign': CallAndAssign}
 _ID_POSITION = 0
 _TYPE_POSITION = 1
+_PARAMS_POSITION = 2
 
 
 def instruction_for(params):
-    ''' Factory method for Instruction types '''
-    instruction_type = params.pop(_TYPE_POSITION)
-    instruction_id = params.pop(_ID_POSITION)
+    ''' Factory method for Instruction types, taking the instruction params
+    from the (unpacked) params list itself '''
+    instruction_type = params[_TYPE_POSITION]
+    instruction_id = params[_ID_POSITION]
+    del params[:_PARAMS_POSITION]
     try:
         return _INSTRUCTION_TYPES[instruction_type](instruction_id, params)
     except KeyError:
         return Instruction(instruction_id, [instruction_type])
 
 
+NO_LOGGING = False
+
+
+def debug_enabled(logger):
+    ''' Whether debug messages logged to logger will be output. Always
+    False in NO_LOGGING mode, so that hot paths can skip even the (cached)
+    level check of the logger. '''
+    return not NO_LOGGING and logger.isEnabledFor(logging.DEBUG)
+
+
 def _debug(logger, msg, substitutions):
-    ''' Log to logger a msg with potentially some substitutions '''
+    ''' Log to logger a msg with potentially some substitutions, which are
+    only formatted if the msg will be output '''
+    if not debug_enabled(logger):
+        return
     try:
         logger.debug(msg % substitutions)
     except:
         logger.warn('Error logging %s:' % msg, exc_info=1)
 
 
+PARALLEL_CALL_THREADS = 16
+
+
+def parallel_calls(fixture_class):
+    ''' Class decorator, allowing the Call-s made on instances of
+    fixture_class to run in parallel with other Call-s that they do not
+    depend on. Equivalent to setting a class attribute parallel_calls=True.
+    '''
+    fixture_class.parallel_calls = True
+    return fixture_class
+
+
 class Instructions(object):
     ''' Container for executable sequence of Instruction-s '''
 
@@ -92,25 +193,191 @@ class Instructions(object):
         self._unpacked_list = unpacked_list
         self._instruction_for = factory_method
         self._logger = logging.getLogger('Instructions')
+        self._debugging = debug_enabled(self._logger)
 
     def execute(self, execution_context, results):
-        ''' Create and execute Instruction-s, collecting the results '''
-        for item in self._unpacked_list:
-            instruction = self._instruction_for(item)
+        ''' Create and execute Instruction-s, collecting the results.
+        Consecutive Call-s of coroutine functions are gathered to run
+        concurrently on the session's event loop, and Call-s on instances of
+        parallel_calls classes are run on a thread pool; any other
+        instruction waits for all such Call-s to complete first. '''
+        batches = {}
+        pending = None
+        try:
+            for item in self._unpacked_list:
+                instruction = self._instruction_for(item)
+                batch_type = _batch_type_for(instruction, execution_context)
+                if pending is not None and pending is not batch_type:
+                    if not batches[pending].complete(results):
+                        return
+                    pending = None
+                if batch_type is None:
+                    if not self._execute(instruction, execution_context,
+                                         results):
+                        return
+                    continue
+                if batch_type not in batches:
+                    batches[batch_type] = batch_type(self, execution_context)
+                batches[batch_type].submit(instruction, results)
+                pending = batch_type
+            if pending is not None:
+                batches[pending].complete(results)
+        finally:
+            for batch in batches.values():
+                batch.shutdown()
+
+    def _execute(self, instruction, execution_context, results):
+        ''' Execute an Instruction, collecting its results. Return False if
+        it stopped the test, True otherwise '''
+        if self._debugging:
             _debug(self._logger, 'Executing %r', instruction)
-            try:
+        instrumentation = getattr(execution_context, 'instrumentation', None)
+        try:
+            if instrumentation is None:
                 instruction.execute(execution_context, results)
-            except Exception as error:
-                self._logger.warn('Error executing %s:', instruction,
-                                  exc_info=1)
-                stop_test = 'stoptest' in type(error).__name__.lower()
-                if error.args:
-                    error_message = error.args[0]
-                else:
-                    error_message = type(error).__name__
-                results.failed(instruction, error_message, stop_test)
-                if stop_test:
-                    break
+            else:
+                instrumentation.execute(
+                    instruction, execution_context,
+                    lambda: instruction.execute(execution_context, results))
+        except Exception as error:
+            return self._failed(instruction, error, results)
+        return True
+
+    def _failed(self, instruction, error, results):
+        ''' Record that an Instruction failed with error. Return False if
+        it stopped the test, True otherwise '''
+        self._logger.warn('Error executing %s:', instruction, exc_info=1)
+        stop_test = 'stoptest' in type(error).__name__.lower()
+        if error.args:
+            error_message = error.args[0]
+        else:
+            error_message = type(error).__name__
+        results.failed(instruction, error_message, stop_test)
+        return not stop_test
+
+
+def _batch_type_for(instruction, execution_context):
+    ''' Get the type of batch in which to run an instruction, or None if
+    it is simply to be executed in sequence - as it is if its target cannot
+    be resolved, so that the error is reported when it is executed '''
+    if not isinstance(instruction, Call):
+        return None
+    try:
+        instance, target = instruction.target(execution_context)
+    except Exception:
+        return None
+    if instance is None:
+        return None
+    if iscoroutinefunction is not None \
+    and target is not None and iscoroutinefunction(target[0]):
+        from .coroutines import CoroutineCalls
+        return CoroutineCalls
+    if ThreadPoolExecutor is not None \
+    and getattr(instance, 'parallel_calls', False) is True:
+        return _ParallelCalls
+    return None
+
+
+class _CallDependencies(object):
+    ''' Tracks which earlier Call-s each Call in a batch depends on: those
+    on the same instance, those assigning a symbol that it uses and, if it
+    assigns a symbol, those reading or assigning that symbol. Each Call is
+    represented by a handle, e.g. the future of its execution. '''
+
+    def __init__(self):
+        ''' Start with no Call-s '''
+        self._last_calls = {}
+        self._assigned = {}
+        self._readers = {}
+
+    def of(self, instruction):
+        ''' Get the handles of the Call-s that instruction depends on '''
+        depends_on = []
+        instance_name = instruction.instance_name()
+        if instance_name in self._last_calls:
+            depends_on.append(self._last_calls[instance_name])
+        for symbol in _symbols_in(instruction.arguments()):
+            if symbol in self._assigned:
+                depends_on.append(self._assigned[symbol])
+        assigned = instruction.assigned_symbol()
+        if assigned is not None:
+            depends_on.extend(self._readers.get(assigned, ()))
+            if assigned in self._assigned:
+                depends_on.append(self._assigned[assigned])
+        return depends_on
+
+    def add(self, instruction, handle):
+        ''' Add a Call that later Call-s may depend on '''
+        self._last_calls[instruction.instance_name()] = handle
+        for symbol in _symbols_in(instruction.arguments()):
+            self._readers.setdefault(symbol, []).append(handle)
+        assigned = instruction.assigned_symbol()
+        if assigned is not None:
+            self._readers.pop(assigned, None)
+            self._assigned[assigned] = handle
+
+
+class _ParallelCalls(object):
+    ''' Runs Call-s on a thread pool, each one as soon as the Call-s that
+    it depends on have completed. Results are collected in the original
+    order. The Call-s use the converters registered for the session's own
+    thread (rather than those of the pool thread). '''
+
+    def __init__(self, instructions, execution_context,
+                 threads=PARALLEL_CALL_THREADS):
+        ''' Provide the Instructions that the Call-s are executed for '''
+        self._instructions = instructions
+        self._execution_context = execution_context
+        self._executor = ThreadPoolExecutor(max_workers=threads)
+        self._converters = registered_converters()
+        self._submitted = []
+        self._dependencies = _CallDependencies()
+
+    def submit(self, instruction, results):
+        ''' Schedule a Call, collecting its results in a deferred Results '''
+        depends_on = self._dependencies.of(instruction)
+        deferred = results.deferred()
+        future = self._executor.submit(self._execute_after, depends_on,
+                                       instruction, deferred)
+        self._dependencies.add(instruction, future)
+        self._submitted.append((future, deferred))
+
+    def complete(self, results):
+        ''' Wait for all submitted Call-s to complete, and include their
+        results in order. Return False if one of them stopped the test, in
+        which case the results of later Call-s are discarded '''
+        submitted, self._submitted = self._submitted, []
+        self._dependencies = _CallDependencies()
+        for position, (future, deferred) in enumerate(submitted):
+            carry_on = future.result()
+            results.include(deferred)
+            if not carry_on:
+                for later_future, _ in submitted[position + 1:]:
+                    later_future.cancel()
+                return False
+        return True
+
+    def shutdown(self):
+        ''' Wait for any running Call-s, then release the thread pool '''
+        self._executor.shutdown(wait=True)
+
+    def _execute_after(self, depends_on, instruction, results):
+        ''' Execute instruction once the Call-s it depends on are done '''
+        wait(depends_on)
+        use_converters(self._converters)
+        return self._instructions._execute(instruction,
+                                           self._execution_context, results)
+
+
+def _symbols_in(params):
+    ''' Get the set of symbol names referred to in (nested) params '''
+    symbols = set()
+    for param in params:
+        if isinstance(param, list):
+            symbols.update(_symbols_in(param))
+        elif '$' in param:
+            symbols.update((_symbol_template(param) or ())[1::2])
+    return symbols
 
 
 class ParamsConverter(object):
@@ -123,34 +390,99 @@ class ParamsConverter(object):
         ''' Provide the execution_context for symbol lookup '''
         self._execution_context = execution_context
 
-    def to_args(self, params, from_position):
-        ''' Convert params[from_postition:] to args tuple '''
-        args = [self._lookup_symbol(param) for param in params[from_position:]]
-        return tuple(args)
+    def to_args(self, params, from_position, typed=False):
+        ''' Convert params[from_postition:] to args tuple. Only params that
+        are lists, or contain a "$", need to be converted at all. If typed,
+        a param that is just a "$symbol" with a typed value is converted to
+        its TypedSymbol. '''
+        lookup_symbol = typed and self._lookup_typed_symbol \
+                        or self._lookup_symbol
+        return tuple([param
+                      if type(param) is not list and '$' not in param
+                      else lookup_symbol(param)
+                      for param in params[from_position:]])
+
+    def _lookup_typed_symbol(self, possible_symbol):
+        ''' Lookup a possible symbol, as a TypedSymbol if possible '''
+        if not isinstance(possible_symbol, list):
+            template = _symbol_template(possible_symbol)
+            if template is not None and len(template) == 3 \
+            and not template[0] and not template[2]:
+                typed_symbol = self._execution_context.get_typed_symbol(
+                    template[1])
+                if typed_symbol is not None:
+                    return typed_symbol
+        return self._lookup_symbol(possible_symbol)
 
     def _lookup_symbol(self, possible_symbol):
         ''' Lookup (recursively if required) a possible symbol '''
         if isinstance(possible_symbol, list):
             return self.to_args(possible_symbol, 0)
-        return ParamsConverter._SYMBOL_PATTERN.sub(
-            self._match,
-            possible_symbol,
-            re.S
-        )
+        if '$' not in possible_symbol:
+            return possible_symbol
+        template = _symbol_template(possible_symbol)
+        if template is None:
+            return possible_symbol
+        parts = list(template)
+        get_symbol = self._execution_context.get_symbol
+        for position in range(1, len(parts), 2):
+            parts[position] = get_symbol(parts[position])
+        return ''.join(parts)
+
+
+_MAX_MEMOISED_NAMES = 4096
+
+
+def _memoise_name(convert):
+    ''' Decorator memoising a name conversion function in a bounded cache'''
+    if lru_cache is not None:
+        return lru_cache(maxsize=_MAX_MEMOISED_NAMES)(convert)
+    converted = {}
+    def memoised(name):
+        ''' callable that looks up or performs (then caches) conversion '''
+        try:
+            return converted[name]
+        except KeyError:
+            if len(converted) >= _MAX_MEMOISED_NAMES:
+                converted.clear()
+            result = converted[name] = convert(name)
+            return result
+    memoised.__doc__ = convert.__doc__
+    return memoised
+
+
+_MAX_MEMOISED_TEMPLATE_LENGTH = 256
+
+
+def _symbol_template(text):
+    ''' Split text into a template of literal parts (at even positions)
+    and the symbol names to substitute between them (at odd positions) -
+    or None if there are no symbols in text. Only the templates of short
+    texts are memoised, so that large args are not kept in memory. '''
+    if len(text) > _MAX_MEMOISED_TEMPLATE_LENGTH:
+        return _split_symbols(text)
+    return _memoised_symbol_template(text)
 
-    def _match(self, match):
-        ''' Actually perform the substitution identified by the match '''
-        if match:
-            return self._execution_context.get_symbol(match.groups()[0])
-        return ''
 
+def _split_symbols(text):
+    ''' The (unmemoised) implementation of _symbol_template '''
+    parts = ParamsConverter._SYMBOL_PATTERN.split(text)
+    if len(parts) == 1:
+        return None
+    return tuple(parts)
 
+
+_memoised_symbol_template = _memoise_name(_split_symbols)
+
+
+@_memoise_name
 def to_pythonic(method_name):
     '''Converts CamelCase to pythonic_case'''
     return (method_name[0].lower() +
             ''.join(map(underscored_lowercase, method_name[1:])))
 
 
+@_memoise_name
 def to_lower_camel_case(method_name):
     '''Converts pythonic_case to camelCase'''
     camel_case = re.sub(
@@ -161,6 +493,7 @@ def to_lower_camel_case(method_name):
     return camel_case[:1].lower() + camel_case[1:]
 
 
+@_memoise_name
 def to_upper_camel_case(method_name):
     '''Converts pythonic_case to CamelCase'''
     camel_case = re.sub(
@@ -178,23 +511,89 @@ def underscored_lowercase(char):
         return char
 
 
+class FixtureCache(object):
+    ''' Process-wide cache of the classes loaded from each imported path.
+    A persistent server shares one FixtureCache between the
+    ExecutionContext-s of all its sessions, so that fixture modules are
+    loaded once rather than once per session. The classes for a path are
+    loaded again once any of its modules has been modified (or invalidated
+    in the MODULE_CACHE). '''
+
+    def __init__(self):
+        ''' Set up the (thread-safe) cache '''
+        self._lock = threading.RLock()
+        self._classes = {}
+
+    def load_classes(self, path):
+        ''' Cached equivalent of load_classes(path) '''
+        with self._lock:
+            cached = self._classes.get(path)
+            if cached is not None and all(
+                source is None or MODULE_CACHE.is_current(module, source)
+                for module, source in cached[0]):
+                return cached[1]
+            modules = load_modules(path)
+            classes = [(name, Class) for module in modules
+                       for name, Class in MODULE_CACHE.classes_of(module)]
+            sources = [(module, MODULE_CACHE.source_of(module))
+                       for module in modules]
+            self._classes[path] = (sources, classes)
+            return classes
+
+    def clear(self):
+        ''' Forget all cached classes (and modules), so they will be loaded
+        again '''
+        with self._lock:
+            self._classes.clear()
+            MODULE_CACHE.invalidate()
+            SYS_PATH_INDEX.invalidate()
+
+
 class ExecutionContext(object):
     def __init__(self, params_converter=ParamsConverter,
-                 logger=logging.getLogger('Execution')):
+                 logger=logging.getLogger('Execution'),
+                 fixture_cache=None,
+                 instrumentation=None,
+                 typed_symbols=False):
+        ''' In typed_symbols mode, the value assigned to each symbol is kept
+        as-is, and only converted to a string when the string is needed. '''
         self._params_converter = params_converter(self)
         self._logger = logger
+        self._debugging = debug_enabled(logger)
+        self._load_classes = fixture_cache and fixture_cache.load_classes \
+                             or load_classes
         self.instances = {}
         self._symbols = {}
+        self._typed_symbols = {} if typed_symbols else None
         self.classes = {}
         self.aliases = {}
+        self._targets = {}
+        self._target_hits = 0
+        self._target_misses = 0
+        self._loop = None
+        self._loop_lock = threading.Lock()
+        self.instrumentation = instrumentation
 
     def get_type(self, fully_qualified_name):
         return self.classes.get(fully_qualified_name, None)
 
     def import_path(self, path):
-        for name, data in load_classes(path):
-            self.classes[name] = data['class']
-            self.aliases[name] = ExecutionContext.get_aliases(data['methods'])
+        ''' Import the classes found in path. Their method aliases are only
+        generated by aliases_for(), when a class is actually used. '''
+        for name, Class in self._load_classes(path):
+            self.classes[name] = Class
+            self.aliases.pop(name, None)
+        self._targets.clear()
+        MODULE_CACHE.save_snapshot()
+
+    def aliases_for(self, class_name):
+        ''' Get (generating if required) the method aliases of a class '''
+        try:
+            return self.aliases[class_name]
+        except KeyError:
+            aliases = self.aliases[class_name] = \
+                MODULE_CACHE.aliases_of(self.classes[class_name])
+            return aliases
 
     @staticmethod
     def get_aliases(methods):
@@ -215,67 +614,251 @@ class ExecutionContext(object):
         return camel_caseds
 
     def target_for(self, instance, method_name):
-        class_name = instance.__class__.__name__
-        method_name = self.aliases[class_name][method_name]
-        if hasattr(instance, method_name):
-            return getattr(instance, method_name)
-        else:
+        resolved = self.resolve_target(instance, method_name)
+        if resolved is None:
             return None
+        function, pass_instance = resolved
+        if pass_instance:
+            return function.__get__(instance, type(instance))
+        return function
+
+    def resolve_target(self, instance, method_name):
+        ''' Resolve the function to invoke for method_name on instance, as
+        a (function, pass_instance) tuple - or None if there is no such
+        method. If pass_instance is True the function is unbound and must be
+        invoked with the instance as its first arg. Resolutions are cached
+        per (type, method_name), so a plain method defined on the class is
+        only looked up once and no bound method is created to invoke it. '''
+        key = (type(instance), method_name)
+        resolved = self._targets.get(key)
+        if resolved is None:
+            resolved = self._targets[key] = _resolve_target(
+                key[0], self.aliases_for(key[0].__name__)[method_name])
+            self._target_misses += 1
+        else:
+            self._target_hits += 1
+        function, attribute_name = resolved
+        if function is not None and attribute_name not in \
+        getattr(instance, '__dict__', _NO_ATTRIBUTES):
+            return (function, True)
+        if hasattr(instance, attribute_name):
+            return (getattr(instance, attribute_name), False)
+        return None
+
+    def resolution_stats(self):
+        ''' Hits and misses of the resolve_target cache '''
+        lookups = self._target_hits + self._target_misses
+        return {'hits': self._target_hits,
+                'misses': self._target_misses,
+                'hit_rate': lookups and float(self._target_hits) / lookups}
 
     def store_instance(self, name, value):
         ''' Add a name=value pair to the context instances '''
-        _debug(self._logger, 'Storing instance %s=%r', (name, value))
+        if self._debugging:
+            _debug(self._logger, 'Storing instance %s=%r', (name, value))
         self.instances[name] = value
 
     def get_instance(self, name):
         return self.instances.get(name, None)
 
     def store_symbol(self, name, value):
-        _debug(self._logger, 'Storing symbol %s=%r', (name, value))
-        self._symbols[name] = to_string(value)
+        if self._debugging:
+            _debug(self._logger, 'Storing symbol %s=%r', (name, value))
+        if self._typed_symbols is None:
+            self._symbols[name] = to_string(value)
+        else:
+            self._typed_symbols[name] = TypedSymbol(value)
 
     def get_symbol(self, name):
         if name in self._symbols:
             value = self._symbols[name]
-            _debug(self._logger, 'Restoring symbol %s=%r', (name, value))
-            return value
+        elif self._typed_symbols is not None and name in self._typed_symbols:
+            value = self._typed_symbols[name].converted()
         else:
             return '$%s' % name
+        if self._debugging:
+            _debug(self._logger, 'Restoring symbol %s=%r', (name, value))
+        return value
 
-    def to_args(self, params, from_position):
-        return self._params_converter.to_args(params, from_position)
+    def get_typed_symbol(self, name):
+        ''' Get the TypedSymbol for name, or None if there is none '''
+        if self._typed_symbols is None:
+            return None
+        return self._typed_symbols.get(name)
+
+    def to_args(self, params, from_position, typed=False):
+        return self._params_converter.to_args(params, from_position, typed)
+
+    def run_coroutine(self, coroutine):
+        ''' Run a coroutine to completion on the event loop of this context,
+        which is created when first needed and kept until close() '''
+        with self._loop_lock:
+            if self._loop is None:
+                import asyncio
+                self._loop = asyncio.new_event_loop()
+            return self._loop.run_until_complete(coroutine)
+
+    def close(self):
+        ''' Release the resources (i.e. event loop) held for the session '''
+        with self._loop_lock:
+            if self._loop is not None:
+                self._loop.run_until_complete(self._loop.shutdown_asyncgens())
+                self._loop.close()
+                self._loop = None
+
+
+_NO_ATTRIBUTES = {}
+
+
+def _resolve_target(target_type, attribute_name):
+    ''' Find a plain function that target_type instances will bind as the
+    method attribute_name, as a (function, attribute_name) tuple. The
+    function is None for anything else (static and class methods, other
+    descriptors, custom attribute access...) which is left to getattr(). '''
+    if getattr(target_type, '__getattribute__', None) \
+    is object.__getattribute__:
+        for klass in getattr(target_type, '__mro__', ()):
+            if attribute_name in klass.__dict__:
+                attribute = klass.__dict__[attribute_name]
+                if isinstance(attribute, types.FunctionType):
+                    return (attribute, attribute_name)
+                break
+    return (None, attribute_name)
 
 
 def load_classes(package_path):
+    ''' Generate the (name, class) of every class loaded from package_path'''
+    for module in load_modules(package_path):
+        for name, Class in MODULE_CACHE.classes_of(module):
+            yield (name, Class)
+
+
+def load_modules(package_path):
+    ''' Get the list of modules loaded from package_path '''
     on_path = find_in_sys_path(package_path)
-    if on_path is not None:
-        if os.path.isfile(on_path):
-            for name, data in get_classes(load_source(on_path)):
-                yield (name, data)
-        else:
-            for module in load_package(on_path):
-                for name, data in get_classes(module):
-                    yield (name, data)
-    else:
-        for name, data in get_classes(__import__(package_path)):
-            yield (name, data)
+    if on_path is None:
+        return [__import__(package_path)]
+    if os.path.isfile(on_path):
+        return [load_source(on_path)]
+    return list(load_package(on_path))
 
 
 def find_in_sys_path(path):
-    for base in sys.path:
-        path = path.replace(".","/") # replace . with / to follow FIT Table format
-        rel_path = os.path.join(base, path)
-        if os.path.exists(rel_path):
-            return rel_path
-        if os.path.exists(rel_path+".py"): # kind of misleading naming but...
-            return rel_path+".py" # if we only load one py file...
-    return None
+    ''' Get the file or directory that a (FitNesse-style, dotted) path
+    refers to in one of the sys.path directories, or None '''
+    return SYS_PATH_INDEX.find(path)
+
+
+class SysPathIndex(object):
+    ''' Resolves paths against sys.path using cached directory listings
+    rather than probing the filesystem for every Import, and remembers what
+    each path resolved to. Names are compared as os.path.normcase() has them,
+    and a path that is not in the listings is probed for directly (and the
+    miss is not remembered), in case it has been added since they were read
+    or the filesystem does not match names case-sensitively. The index is
+    rebuilt whenever sys.path (or the working directory) changes;
+    invalidate() forgets it, e.g. once fixture files have been moved or
+    deleted while a long-lived server is running. '''
+
+    def __init__(self):
+        ''' Set up the (thread-safe) index '''
+        self._lock = threading.RLock()
+        self._sys_path = None
+        self._listings = {}
+        self._found = {}
+        self._lookups = 0
+        self._probes = 0
+        self._probes_avoided = 0
+
+    def find(self, path):
+        ''' Find path as a directory, or as a .py file, in sys.path '''
+        with self._lock:
+            sys_path = (os.getcwd(), tuple(sys.path))
+            if sys_path != self._sys_path:
+                self._sys_path = sys_path
+                self._listings.clear()
+                self._found.clear()
+            self._lookups += 1
+            try:
+                on_path, naive_probes = self._found[path]
+            except KeyError:
+                probes = self._probes
+                on_path, naive_probes = self._resolve(path)
+                if on_path is not None:
+                    self._found[path] = (on_path, naive_probes)
+                naive_probes -= self._probes - probes
+            self._probes_avoided += naive_probes
+            return on_path
+
+    def invalidate(self):
+        ''' Forget all cached directory listings and resolved paths '''
+        with self._lock:
+            self._sys_path = None
+
+    def stats(self):
+        ''' Get the number of lookups made, the filesystem probes that they
+        needed, and how many probes the index has avoided in total '''
+        with self._lock:
+            return {'lookups': self._lookups,
+                    'probes': self._probes,
+                    'probes_avoided': self._probes_avoided}
+
+    def _resolve(self, path):
+        ''' Get what path is in sys.path, along with the number of probes
+        that checking for it directly would have taken '''
+        rel_path = path.replace(".", "/") # follow FIT Table format
+        parent, name = os.path.split(rel_path)
+        if not name or os.path.isabs(rel_path):
+            return self._probe(rel_path)
+        naive_probes = 0
+        normcase = os.path.normcase
+        for base in sys.path:
+            names = self._listing(os.path.join(base, parent))
+            on_path = os.path.join(base, rel_path)
+            for suffix in ("", ".py"):
+                naive_probes += 1
+                if normcase(name + suffix) in names \
+                and self._exists(on_path + suffix):
+                    return on_path + suffix, naive_probes
+        return self._probe(rel_path)[0], naive_probes
+
+    def _probe(self, rel_path):
+        ''' Check for rel_path in sys.path without the index '''
+        naive_probes = 0
+        for base in sys.path:
+            on_path = os.path.join(base, rel_path)
+            for candidate in (on_path, on_path + ".py"):
+                naive_probes += 1
+                if self._exists(candidate):
+                    return candidate, naive_probes
+        return None, naive_probes
+
+    def _listing(self, directory):
+        ''' Get the (cached) set of names in a directory '''
+        try:
+            return self._listings[directory]
+        except KeyError:
+            self._probes += 1
+            try:
+                names = frozenset([os.path.normcase(name) for name
+                                   in os.listdir(directory or os.curdir)])
+            except (OSError, IOError):
+                names = frozenset()
+            self._listings[directory] = names
+            return names
+
+    def _exists(self, path):
+        ''' Check (uncached) whether path exists '''
+        self._probes += 1
+        return os.path.exists(path)
+
+
+SYS_PATH_INDEX = SysPathIndex()
 
 
 def load_source(source_path):
-    import imp
     name = os.path.splitext(os.path.basename(source_path))[0]
-    return imp.load_source(name, source_path)
+    return MODULE_CACHE.load(name, source_path)
 
 
 def load_package(package_path):
@@ -286,13 +869,269 @@ def load_package(package_path):
             for module in load_package(subpackage_path):
                 yield module
         else:
-            yield loader.find_module(name).load_module(name)
+            yield MODULE_CACHE.load(name, _module_file(loader, name))
 
 
-def get_classes(module):
+def _module_file(loader, name):
+    ''' Get the path of the source (or compiled) file of module name, as
+    found by a pkgutil.iter_modules() loader '''
+    try:
+        return loader.find_spec(name).origin
+    except AttributeError:  # py2 ImpImporter
+        return loader.find_module(name).get_filename(name)
+
+
+def _execute_module(name, file_path):
+    ''' Execute (and return) the module in file_path, registering it in
+    sys.modules under name - as imp.load_source used to do '''
+    try:
+        from importlib.util import spec_from_file_location, module_from_spec
+    except ImportError:  # py2 has no importlib.util
+        import imp
+        # otherwise imp re-executes the source in the existing module
+        sys.modules.pop(name, None)
+        return imp.load_source(name, file_path)
+    spec = spec_from_file_location(name, file_path)
+    module = module_from_spec(spec)
+    sys.modules[name] = module
+    try:
+        spec.loader.exec_module(module)
+    except BaseException:
+        del sys.modules[name]
+        raise
+    return module
+
+
+class ModuleCache(object):
+    ''' Process-wide cache of the fixture modules loaded by Import-s, keyed
+    on their resolved path and modification time, so that a module body is
+    only executed again once its file has changed. The classes found in each
+    module, and the methods and aliases of each class, are cached alongside
+    the module. The classes (and the methods of the classes defined in the
+    module itself) are also recorded in the snapshot, if one is in use.
+
+    invalidate() forgets one (or every) module, e.g. so that edits are picked
+    up by a long-lived server in development even if mtimes are unreliable.
+    '''
+
+    def __init__(self, snapshot=None):
+        ''' Set up the (thread-safe) cache, optionally with a FixtureSnapshot
+        from which to read class metadata instead of introspecting modules '''
+        self._lock = threading.RLock()
+        self.snapshot = snapshot
+        self._modules = {}
+        self._sources = {}
+        self._classes = {}
+        self._methods = {}
+        self._aliases = {}
+
+    def load(self, name, file_path):
+        ''' Get the module in file_path - executing it only if it has not
+        been loaded before, or has been modified since '''
+        key = os.path.realpath(file_path)
+        mtime = os.stat(key).st_mtime
+        with self._lock:
+            cached = self._modules.get(key)
+            if cached is not None and cached[0] == mtime:
+                return cached[1]
+            module = _execute_module(name, file_path)
+            self._forget(key)
+            self._modules[key] = (mtime, module)
+            self._sources[id(module)] = (key, mtime)
+            return module
+
+    def source_of(self, module):
+        ''' Get the (resolved path, mtime) of the file that module was
+        loaded from by load(), or None if it was not '''
+        return self._sources.get(id(module))
+
+    def is_current(self, module, source):
+        ''' Whether module, loaded from source (as from source_of), is still
+        the cached module for its file and that file has not been modified '''
+        cached = self._modules.get(source[0])
+        if cached is None or cached[1] is not module:
+            return False
+        try:
+            return os.stat(source[0]).st_mtime == source[1]
+        except OSError:
+            return False
+
+    def classes_of(self, module):
+        ''' Get the (name, class) of every class in a module '''
+        key = id(module)
+        try:
+            return self._classes[key][1]
+        except KeyError:
+            with self._lock:
+                classes = self._snapshot_classes(module)
+                if classes is None:
+                    classes = list(find_classes(module))
+                    self._snapshot_record(module, classes)
+                self._classes[key] = (module, classes)
+            return classes
+
+    def methods_of(self, Class):
+        ''' Get the names of the (non-special) methods of a class '''
+        try:
+            return self._methods[Class]
+        except KeyError:
+            methods = get_methods(Class)
+            with self._lock:
+                self._methods[Class] = methods
+            return methods
+
+    def aliases_of(self, Class):
+        ''' Get the method aliases of a class '''
+        try:
+            return self._aliases[Class]
+        except KeyError:
+            aliases = ExecutionContext.get_aliases(self.methods_of(Class))
+            with self._lock:
+                self._aliases[Class] = aliases
+            return aliases
+
+    def save_snapshot(self):
+        ''' Write out any class metadata added to the snapshot '''
+        if self.snapshot is not None:
+            with self._lock:
+                self.snapshot.save()
+
+    def invalidate(self, file_path=None):
+        ''' Forget the module in file_path, or all modules if no path is
+        specified, so they will be executed again by the next Import '''
+        with self._lock:
+            if file_path is None:
+                self._modules.clear()
+                self._sources.clear()
+                self._classes.clear()
+                self._methods.clear()
+                self._aliases.clear()
+            else:
+                self._forget(os.path.realpath(file_path))
+
+    def _forget(self, key):
+        ''' Forget a cached module along with its class/method metadata '''
+        cached = self._modules.pop(key, None)
+        if cached is None:
+            return
+        self._sources.pop(id(cached[1]), None)
+        classes = self._classes.pop(id(cached[1]), (None, ()))[1]
+        for _, Class in classes:
+            self._methods.pop(Class, None)
+            self._aliases.pop(Class, None)
+
+    def _snapshot_classes(self, module):
+        ''' Get the (name, class) of every class in a module, as recorded
+        in the snapshot - or None if it has no up-to-date record '''
+        import inspect
+        source = self._sources.get(id(module))
+        if self.snapshot is None or source is None:
+            return None
+        recorded = self.snapshot.get(*source)
+        if recorded is None:
+            return None
+        classes = []
+        for name, methods in sorted(recorded.items()):
+            Class = getattr(module, name, None)
+            if not inspect.isclass(Class):
+                return None
+            classes.append((name, Class))
+            if methods is not None:
+                self._methods.setdefault(Class, methods)
+        return classes
+
+    def _snapshot_record(self, module, classes):
+        ''' Record the classes in a module in the snapshot, with the methods
+        of those defined in the module itself: classes it only imports are
+        recorded (and introspected) with the module that defines them '''
+        source = self._sources.get(id(module))
+        if self.snapshot is None or source is None:
+            return
+        recorded = dict((name, self.methods_of(Class)
+                               if Class.__module__ == module.__name__
+                               else None)
+                        for name, Class in classes)
+        self.snapshot.put(source[0], source[1], recorded)
+
+
+class FixtureSnapshot(object):
+    ''' On-disk (JSON) record of the classes found in each fixture module
+    file, with the methods of each class defined there, keyed by the resolved
+    path and modification time of the file. Modules are still executed when
+    imported, but a ModuleCache with an up-to-date snapshot does not have to
+    introspect them, which makes warm starts with large fixture trees faster.
+
+    Note that the record for a module is not invalidated when only a base
+    class from another module changes: delete the snapshot file in that case.
+    '''
+    VERSION = 2
+
+    def __init__(self, path):
+        ''' Read the snapshot from path, if it exists and is valid '''
+        self.path = path
+        self._modules = {}
+        self._modified = False
+        try:
+            with open(path) as snapshot_file:
+                snapshot = json.load(snapshot_file)
+            if snapshot.get('version') == FixtureSnapshot.VERSION:
+                self._modules = snapshot['modules']
+        except (IOError, OSError, ValueError, KeyError, AttributeError):
+            pass
+
+    def get(self, file_path, mtime):
+        ''' Get the classes recorded for file_path at mtime, or None '''
+        recorded = self._modules.get(file_path)
+        if recorded is None or recorded['mtime'] != mtime:
+            return None
+        return recorded['classes']
+
+    def put(self, file_path, mtime, classes):
+        ''' Record the classes in file_path at mtime, as a dict of
+        class name: method names (or None, for an imported class) '''
+        self._modules[file_path] = {'mtime': mtime, 'classes': classes}
+        self._modified = True
+
+    def save(self):
+        ''' Write the snapshot to its file, if it has been modified '''
+        if not self._modified:
+            return
+        temporary_path = '%s.%s.tmp' % (self.path, os.getpid())
+        with open(temporary_path, 'w') as snapshot_file:
+            json.dump({'version': FixtureSnapshot.VERSION,
+                       'modules': self._modules},
+                      snapshot_file, separators=(',', ':'))
+        _replace(temporary_path, self.path)
+        self._modified = False
+
+
+def _replace(from_path, to_path):
+    ''' Rename from_path to to_path, replacing to_path if it exists '''
+    try:
+        os.replace(from_path, to_path)
+    except AttributeError:  # py2 has no os.replace
+        if os.path.exists(to_path):
+            os.remove(to_path)
+        os.rename(from_path, to_path)
+
+
+MODULE_CACHE = ModuleCache()
+
+
+def find_classes(module):
+    ''' Generate the (name, class) of every class in a module '''
+    import inspect
+    return inspect.getmembers(module, inspect.isclass)
+
+
+def get_methods(Class):
+    ''' List the names of the (non-special) methods of a class '''
     import inspect
-    for class_name, Class in inspect.getmembers(module, inspect.isclass):
-        methods = [n
-                   for n, _ in inspect.getmembers(Class, inspect.isroutine)
-                   if '__' not in n]
-        yield (class_name, {'class': Class, 'methods': methods})
+    return [n
+            for n, _ in inspect.getmembers(Class, inspect.isroutine)
+            if '__' not in n]
+
+
+def get_classes(module):
+    for class_name, Class in find_classes(module):
+        yield (class_name, {'class': Class, 'methods': get_methods(Class)})
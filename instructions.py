@@ -12,9 +12,16 @@ _NO_CONSTRUCTION = 'COULD_NOT_INVOKE_CONSTRUCTOR'
 _NO_INSTANCE = 'NO_INSTANCE'
 _NO_METHOD = 'NO_METHOD_IN_CLASS'
 
+try:
+    from inspect import iscoroutine as _ISCOROUTINE
+except ImportError:  # no coroutines before py3.5
+    _ISCOROUTINE = None
+
 
 class Instruction(object):
-    ''' Base class for instructions '''
+    ''' Base class for instructions. Instruction-s are created for every
+    row of every table, so (like all subclasses) use __slots__. '''
+    __slots__ = ('_id', '_params')
 
     def __init__(self, instruction_id, params):
         ''' Specify the id of this instruction, and its params.
@@ -40,6 +47,7 @@ class Instruction(object):
 
 class Import(Instruction):
     ''' An "import <path or module context>" instruction '''
+    __slots__ = ()
 
     def execute(self, execution_context, results):
         ''' Adds an imported path or module context to the execution context'''
@@ -54,6 +62,11 @@ class Import(Instruction):
 
 class Make(Instruction):
     ''' A "make <instance>, <class>, <args>..." instruction '''
+    __slots__ = ()
+
+    def class_name(self):
+        ''' Return the name of the class that this instruction instantiates'''
+        return self._params[1]
 
     def execute(self, execution_context, results):
         ''' Create a class instance and add it to the execution context '''
@@ -78,12 +91,60 @@ class Make(Instruction):
 
 class Call(Instruction):
     ''' A "call <instance>, <function>, <args>..." instruction '''
+    __slots__ = ('_target',)
 
     def execute(self, execution_context, results):
-        ''' Delegate to _invoke_call then record results on completion '''
-        result, is_ok = self._invoke(execution_context, results, self._params)
+        ''' Delegate to invoke() then record results on completion, running
+        any coroutine returned to completion first '''
+        result, is_ok = self.invoke(execution_context, results)
         if is_ok:
-            results.completed(self, result)
+            if _iscoroutine(result):
+                result = execution_context.run_coroutine(result)
+            self.complete(execution_context, results, result)
+
+    def invoke(self, execution_context, results):
+        ''' Invoke the method, returning a tuple of (result, is_ok) '''
+        return self._invoke(execution_context, results, self._params)
+
+    def complete(self, execution_context, results, result):
+        ''' Record the result of the (successfully) invoked method '''
+        results.completed(self, result)
+
+    def instance_name(self):
+        ''' Return the name of the instance that this instruction calls '''
+        return self._params[0]
+
+    def method_name(self):
+        ''' Return the name of the method that this instruction calls '''
+        return self._params[1]
+
+    def arguments(self):
+        ''' Return the (unconverted) arguments of the call '''
+        return self._params[2:]
+
+    def assigned_symbol(self):
+        ''' Return the name of the symbol that this instruction assigns,
+        or None '''
+        return None
+
+    def target(self, execution_context):
+        ''' Return the (instance, target) that this instruction calls, where
+        target is as from execution_context.resolve_target() - either may be
+        None. Once looked up they are kept, however often this is called;
+        if the lookup raises an error nothing is kept, so the next call
+        looks them up again. '''
+        try:
+            return self._target
+        except AttributeError:
+            pass
+        instance = execution_context.get_instance(self.instance_name())
+        if instance is None:
+            target = None
+        else:
+            target = execution_context.resolve_target(instance,
+                                                      self.method_name())
+        self._target = (instance, target)
+        return self._target
 
     def _invoke(self, execution_context, results, params):
         ''' Get an instance from the execution context and invoke a method:
@@ -91,35 +152,57 @@ class Call(Instruction):
         -  try to invoke the named method on the system under test
         -  try to invoke the named method via libraries
         '''
-        instance_name, target_name = params[0], params[1]
-        instance = execution_context.get_instance(instance_name)
+        instance, target = self.target(execution_context)
         if instance is not None:
-            target = execution_context.target_for(instance, target_name)
             if target is not None:
-                args = execution_context.to_args(params, 2)
-                result = target(*args)
+                function, pass_instance = target
+                args = execution_context.to_args(
+                    params, 2, getattr(function, 'typed_symbols', False))
+                if pass_instance:
+                    result = function(instance, *args)
+                else:
+                    result = function(*args)
                 return (result, True)
             else:
-                cause = '%s %s %s' % (_NO_METHOD, target_name,
+                cause = '%s %s %s' % (_NO_METHOD, params[1],
                                       type(instance).__name__)
                 results.failed(self, cause)
         else:  # instance is None
-            results.failed(self, '%s %s' % (_NO_INSTANCE, instance_name))
+            results.failed(self, '%s %s' % (_NO_INSTANCE, params[0]))
         return (None, False)
 
 
 class CallAndAssign(Call):
     ''' A "callAndAssign <symbol>, <instance>, <function>, <args>..."
     instruction '''
+    __slots__ = ()
 
-    def execute(self, execution_context, results):
-        ''' Delegate to _invoke_call then set variable and record results
-        on completion '''
-        params_copy = []
-        params_copy.extend(self._params)
-        symbol_name = params_copy.pop(0)
+    def instance_name(self):
+        ''' Return the name of the instance that this instruction calls '''
+        return self._params[1]
 
-        result, is_ok = self._invoke(execution_context, results, params_copy)
-        if is_ok:
-            execution_context.store_symbol(symbol_name, result)
-            results.completed(self, result)
+    def method_name(self):
+        ''' Return the name of the method that this instruction calls '''
+        return self._params[2]
+
+    def arguments(self):
+        ''' Return the (unconverted) arguments of the call '''
+        return self._params[3:]
+
+    def assigned_symbol(self):
+        ''' Return the name of the symbol that this instruction assigns '''
+        return self._params[0]
+
+    def invoke(self, execution_context, results):
+        ''' Invoke the method, returning a tuple of (result, is_ok) '''
+        return self._invoke(execution_context, results, self._params[1:])
+
+    def complete(self, execution_context, results, result):
+        ''' Set variable then record the result of the invoked method '''
+        execution_context.store_symbol(self._params[0], result)
+        results.completed(self, result)
+
+
+def _iscoroutine(value):
+    ''' Whether value is a coroutine, to be run to completion (py3.5+) '''
+    return _ISCOROUTINE is not None and _ISCOROUTINE(value)
@@ -0,0 +1,213 @@
+'''
+Instrumentation of Slim sessions, to find out which protocol phases and
+which fixture methods dominate a slow test page.
+
+An Instrumentation records wall-clock and CPU time (and bytes) for each
+protocol phase of every message - recv, unpack, execute, pack and send -
+and wall-clock and CPU time for each instruction executed, aggregated by
+instruction type, by fixture class and by fixture method. Calls of named
+fixture methods can also be profiled with cProfile. The report() is a
+structured (JSON-compatible) dict, written out at the end of each session.
+
+Note that with StreamingResults (the default for the WaferSlimServer) each
+result is packed as it is collected, so packing is counted under the
+execute phase and no pack phase is recorded at all.
+
+The server options --instrument=FILE and --profile=METHODS give every
+session its own Instrumentation, appending each session report to FILE as
+a line of JSON. Otherwise, set the instrumentation of an ExecutionContext.
+
+The latest source code is available at http://code.launchpad.net/waferslim.
+
+Copyright 2009-2010 by the author(s). All rights reserved
+'''
+import json
+import logging
+import threading
+import time
+
+PHASES = ('recv', 'unpack', 'execute', 'pack', 'send')
+PROFILE_ENTRIES = 50
+
+# Sessions on different threads append to the same report file
+_REPORT_LOCK = threading.Lock()
+
+try:
+    _wall_time = time.perf_counter
+except AttributeError:  # only introduced in 3.3
+    _wall_time = time.time
+try:
+    _cpu_time = time.thread_time
+except AttributeError:  # only introduced in 3.7
+    try:
+        _cpu_time = time.process_time
+    except AttributeError:  # only introduced in 3.3
+        _cpu_time = time.clock
+
+
+def for_session(report_path='', profile_methods=''):
+    ''' Create the Instrumentation for a new session, from the (string)
+    values of the --instrument and --profile server options - or None if
+    neither has been specified '''
+    if not report_path and not profile_methods:
+        return None
+    methods = [m.strip() for m in profile_methods.split(',') if m.strip()]
+    return Instrumentation(report_path, methods)
+
+
+class Instrumentation(object):
+    ''' Collects timings for one session (and is thread-safe, as instructions
+    may be executed in parallel) '''
+
+    def __init__(self, report_path=None, profile_methods=()):
+        ''' Specify where to append the report at the end of the session, and
+        the fixture methods (as "method" or "Class.method") to profile '''
+        self.report_path = report_path
+        self._profile_methods = frozenset(profile_methods)
+        self._profiler = None
+        self._profile_lock = threading.Lock()
+        self._lock = threading.Lock()
+        self._phases = dict((phase, [0, 0.0, 0.0, 0]) for phase in PHASES)
+        self._by_type = {}
+        self._by_class = {}
+        self._by_method = {}
+
+    def mark(self):
+        ''' Get the current (wall-clock, CPU) time, to measure a phase or
+        instruction from '''
+        return _wall_time(), _cpu_time()
+
+    def phase(self, name, since, byte_count=0):
+        ''' Record a protocol phase that started at mark since, with the
+        bytes it transferred. Return a mark for the next phase. '''
+        now = self.mark()
+        with self._lock:
+            totals = self._phases[name]
+            totals[0] += 1
+            totals[1] += now[0] - since[0]
+            totals[2] += now[1] - since[1]
+            totals[3] += byte_count
+        return now
+
+    def execute(self, instruction, execution_context, execute):
+        ''' Execute an instruction by calling execute(), recording its time
+        (and profiling it, if its fixture method is to be profiled) '''
+        since = self.mark()
+        if self._profile_methods \
+        and self._to_profile(instruction, execution_context):
+            try:
+                return self._profile(execute)
+            finally:
+                self.instruction(instruction, execution_context, since)
+        try:
+            return execute()
+        finally:
+            self.instruction(instruction, execution_context, since)
+
+    def instruction(self, instruction, execution_context, since):
+        ''' Record an instruction executed from mark since '''
+        now = self.mark()
+        elapsed = (now[0] - since[0], now[1] - since[1])
+        class_name, method_name = _fixture_of(instruction, execution_context)
+        with self._lock:
+            _add(self._by_type, type(instruction).__name__, elapsed)
+            if class_name is not None:
+                _add(self._by_class, class_name, elapsed)
+            if method_name is not None:
+                _add(self._by_method, '%s.%s' % (class_name, method_name),
+                     elapsed)
+
+    def report(self):
+        ''' Get the structured report of the timings collected so far '''
+        with self._lock:
+            report = {
+                'phases': dict((name, {'count': totals[0],
+                                       'wall': totals[1],
+                                       'cpu': totals[2],
+                                       'bytes': totals[3]})
+                               for name, totals in self._phases.items()),
+                'instructions': {
+                    'by_type': _as_report(self._by_type),
+                    'by_class': _as_report(self._by_class),
+                    'by_method': _as_report(self._by_method),
+                },
+            }
+        if self._profiler is not None:
+            report['profile'] = _profile_report(self._profiler)
+        return report
+
+    def session_ended(self):
+        ''' Append the report to report_path (if any) as a line of JSON '''
+        report = json.dumps(self.report(), sort_keys=True)
+        logging.getLogger('Instrumentation').debug('Session report: %s',
+                                                   report)
+        if self.report_path:
+            # unbuffered, so that each line is appended by a single write
+            # (and is not interleaved with the lines of pre-forked workers)
+            line = (report + '\n').encode('utf-8')
+            with _REPORT_LOCK:
+                with open(self.report_path, 'ab', 0) as report_file:
+                    report_file.write(line)
+
+    def _to_profile(self, instruction, execution_context):
+        ''' Whether an instruction calls a fixture method to be profiled '''
+        class_name, method_name = _fixture_of(instruction, execution_context)
+        return method_name is not None and (
+            method_name in self._profile_methods
+            or '%s.%s' % (class_name, method_name) in self._profile_methods)
+
+    def _profile(self, execute):
+        ''' Call execute() with the profiler enabled (one call at a time) '''
+        import cProfile
+        with self._profile_lock:
+            if self._profiler is None:
+                self._profiler = cProfile.Profile()
+            self._profiler.enable()
+            try:
+                return execute()
+            finally:
+                self._profiler.disable()
+
+
+def _fixture_of(instruction, execution_context):
+    ''' Get the fixture class name and method name that an instruction
+    concerns - either may be None '''
+    if hasattr(instruction, 'method_name'):
+        instance = execution_context.get_instance(instruction.instance_name())
+        if instance is None:
+            return None, None
+        return type(instance).__name__, instruction.method_name()
+    if hasattr(instruction, 'class_name'):
+        return instruction.class_name(), None
+    return None, None
+
+
+def _add(totals, key, elapsed):
+    ''' Add an elapsed (wall-clock, CPU) time to the totals for key '''
+    try:
+        entry = totals[key]
+    except KeyError:
+        entry = totals[key] = [0, 0.0, 0.0]
+    entry[0] += 1
+    entry[1] += elapsed[0]
+    entry[2] += elapsed[1]
+
+
+def _as_report(totals):
+    ''' Convert totals to their report format '''
+    return dict((key, {'count': entry[0], 'wall': entry[1], 'cpu': entry[2]})
+                for key, entry in totals.items())
+
+
+def _profile_report(profiler):
+    ''' Get the PROFILE_ENTRIES functions with the highest cumulative time
+    from a cProfile profiler, in its report format '''
+    import pstats
+    stats = pstats.Stats(profiler).stats
+    entries = [{'function': '%s:%s(%s)' % function,
+                'calls': calls,
+                'total': total,
+                'cumulative': cumulative}
+               for function, (_, calls, total, cumulative, _) in stats.items()]
+    entries.sort(key=lambda entry: entry['cumulative'], reverse=True)
+    return entries[:PROFILE_ENTRIES]
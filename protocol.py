@@ -13,9 +13,11 @@ from .execution import Results, ExecutionContext, Instructions
 import re
 import six
 import sys
+import tempfile
 
 BYTE_ENCODING = 'utf-8'  # can be altered by server startup options
-BUFFER_SIZE = 4098
+BUFFER_SIZE = 65536
+SPILL_THRESHOLD = 8 * 1024 * 1024  # bytes of results kept in memory
 _VERSION = 'Slim -- V0.3\n'
 _START_CHUNK = '['
 _END_CHUNK = ']'
@@ -45,40 +47,132 @@ class UnpackingError(WaferSlimException):
 def unpack(packed_string):
     ''' Unpack a chunked-up packed_string into a list '''
     chunks = []
-    _unpack_chunk(packed_string, chunks)
+    _unpack_chunk(packed_string, 0, len(packed_string), _TEXT_MARKS, None,
+                  chunks)
     return chunks
 
 
-def _unpack_chunk(packed_chunk, chunks):
-    ''' Unpack a packed chunk, recursively if required '''
-    _check_chunk(packed_chunk)
-    pos = 1
-    chunk_len = int(packed_chunk[pos:pos + _NUMERIC_LENGTH])
-    _check_separator(packed_chunk, pos + _NUMERIC_LENGTH)
-    pos += _NUMERIC_BLOCK_LENGTH
+def unpack_bytes(packed_bytes, encoding=None):
+    ''' Unpack a chunked-up packed_bytes into a list of (unicode) strings,
+    in a single pass over the bytes: only the leaf items are ever copied out
+    and decoded. Item lengths are counted in characters, so byte offsets can
+    only be used directly when every character is a single byte - anything
+    else is decoded once up front and then unpacked as text. '''
+    encoding = encoding or BYTE_ENCODING
+    if not (_is_ascii(packed_bytes) and _ascii_compatible(encoding)):
+        return unpack(packed_bytes.decode(encoding))
+    chunks = []
+    _unpack_chunk(packed_bytes, 0, len(packed_bytes), _BYTE_MARKS, encoding,
+                  chunks)
+    return chunks
 
-    for i in range(0, chunk_len):
-        item_len = int(packed_chunk[pos:pos + _NUMERIC_LENGTH])
-        _check_separator(packed_chunk, pos + _NUMERIC_LENGTH)
-        pos += _NUMERIC_BLOCK_LENGTH
 
-        item = packed_chunk[pos:pos + item_len]
-        _check_separator(packed_chunk, pos + item_len)
-        pos += (item_len + _SEPARATOR_LENGTH)
+_TEXT_MARKS = (_START_CHUNK, _SEPARATOR, _END_CHUNK)
+_ENCODED_MARKS = ''.join(_TEXT_MARKS).encode('ascii')
+_BYTE_MARKS = tuple([_ENCODED_MARKS[i] for i in range(3)])  # int in python3
+_MIN_CHUNK_LENGTH = 2 * _NUMERIC_BLOCK_LENGTH + 2
+
+
+def _is_ascii(value):
+    ''' True if every character (or byte) in value is plain ascii '''
+    try:
+        return value.isascii()
+    except AttributeError:  # only introduced in 3.7
+        try:
+            if isinstance(value, six.text_type):
+                value.encode('ascii')
+            else:
+                value.decode('ascii')
+            return True
+        except UnicodeError:
+            return False
+
+
+def _ascii_compatible(encoding):
+    ''' True if encoding maps ascii characters onto identical bytes '''
+    return _ENCODED_MARKS == ''.join(_TEXT_MARKS).encode(encoding)
+
+
+def _unpack_chunk(packed, start, end, marks, encoding, chunks):
+    ''' Unpack the chunk at packed[start:end] into chunks, using a cursor
+    rather than slicing. Nested chunks are unpacked in place (recursively)
+    and leaf items are sliced out, then decoded if encoding is specified. '''
+    start_mark, separator, end_mark = marks
+    if end <= start or packed[start] != start_mark:
+        msg = '%r has no leading %r' % (_describe(packed, start, end, encoding),
+                                        _START_CHUNK)
+        raise UnpackingError(msg)
+    if packed[end - 1] != end_mark:
+        msg = '%r has no trailing %r' % (_describe(packed, start, end,
+                                                   encoding), _END_CHUNK)
+        raise UnpackingError(msg)
+
+    pos = start + 1
+    chunk_len = _read_length(packed, pos, start, end, separator, encoding)
+    pos += _NUMERIC_BLOCK_LENGTH
 
-        if is_chunk(item):
+    for i in range(0, chunk_len):
+        item_start = pos + _NUMERIC_BLOCK_LENGTH
+        digits = packed[pos:item_start - _SEPARATOR_LENGTH]
+        if item_start >= end or packed[item_start - 1] != separator \
+        or not digits.isdigit():
+            _read_length(packed, pos, start, end, separator, encoding)
+        item_end = item_start + int(digits)
+        if item_end >= end or packed[item_end] != separator:
+            _separator_error(packed, item_end, start, end, encoding)
+
+        if packed[item_start] == start_mark \
+        and _is_chunk_at(packed, item_start, item_end, marks):
             sub_chunk = []
-            _unpack_chunk(item, sub_chunk)
+            _unpack_chunk(packed, item_start, item_end, marks, encoding,
+                          sub_chunk)
             chunks.append(sub_chunk)
-#        elif isinstance(item, unicode):
-#            chunks.append(item.encode(BYTE_ENCODING))
+        elif encoding:
+            chunks.append(packed[item_start:item_end].decode(encoding))
         else:
-            chunks.append(item)
+            chunks.append(packed[item_start:item_end])
+        pos = item_end + _SEPARATOR_LENGTH
+
+
+def _read_length(packed, pos, start, end, separator, encoding):
+    ''' Read the numeric length at pos, verifying its trailing separator '''
+    separator_pos = pos + _NUMERIC_LENGTH
+    if separator_pos >= end or packed[separator_pos] != separator:
+        _separator_error(packed, separator_pos, start, end, encoding)
+    digits = packed[pos:separator_pos]
+    if not digits.isdigit():
+        msg = ('%r has no numeric length at pos %s' %
+               (_describe(packed, start, end, encoding), pos - start))
+        raise UnpackingError(msg)
+    return int(digits)
+
+
+def _separator_error(packed, pos, start, end, encoding):
+    ''' Raise an error for a missing separator at position pos '''
+    msg = ('%r has no %r separator at pos %s' %
+           (_describe(packed, start, end, encoding), _SEPARATOR, pos - start))
+    raise UnpackingError(msg)
+
+
+def _describe(packed, start, end, encoding):
+    ''' The chunk at packed[start:end], as text for error messages '''
+    chunk = packed[start:end]
+    return encoding and chunk.decode(encoding, 'replace') or chunk
 
 
-def _check_chunk(packed_chunk):
-    ''' Verify format of an packed_chunk '''
-    is_chunk(packed_chunk, raise_on_failure=True)
+def _is_chunk_at(packed, start, end, marks):
+    ''' Check the fixed-width header of packed[start:end] to see whether it
+    is itself a nested chunk - equivalent to is_chunk() but without a copy
+    of the item or a regex match '''
+    start_mark, separator, end_mark = marks
+    count_end = start + 1 + _NUMERIC_LENGTH
+    length_end = count_end + _NUMERIC_BLOCK_LENGTH
+    return (end - start >= _MIN_CHUNK_LENGTH
+            and packed[end - 1] == end_mark
+            and packed[count_end] == separator
+            and packed[length_end] == separator
+            and packed[start + 1:count_end].isdigit()
+            and packed[count_end + 1:length_end].isdigit())
 
 CHUNK_RE = re.compile('^\[[0-9]{%s,%s}\:[0-9]{%s,%s}\:' % (_NUMERIC_LENGTH,
                                                            _NUMERIC_LENGTH,
@@ -102,14 +196,6 @@ def is_chunk(possible_chunk, raise_on_failure=False):
     raise UnpackingError(msg)
 
 
-def _check_separator(packed_chunk, pos):
-    ''' Verify existence of separator at position pos in a packed_chunk '''
-    if _SEPARATOR != packed_chunk[pos]:
-        msg = ('%r has no %r separator at pos %s' %
-               (packed_chunk, _SEPARATOR, pos))
-        raise UnpackingError(msg)
-
-
 def pack(item_list):
     ''' Pack each item from a list into the chunked-up format '''
     packed = [_pack_item(item) for item in item_list]
@@ -121,7 +207,7 @@ def pack(item_list):
 def _pack_item(item):
     ''' Pack (recursively if required) a single item in the format:
     [iiiiii:llllll:item...]'''
-    if isinstance(item, list):
+    if isinstance(item, (list, tuple)):
         return _pack_item(pack(item))
     if isinstance(item, str):
         if sys.version_info.major<3:
@@ -132,33 +218,382 @@ def _pack_item(item):
     raise TypeError('%r is not a string' % item)
 
 
+def pack_bytes(item_list, encoding=None):
+    ''' Pack each item from a list into the chunked-up format, producing
+    bytes directly - equivalent to pack(item_list).encode(encoding) '''
+    return six.binary_type(_pack_buffer(item_list, False, encoding))
+
+
+def pack_message(item_list, encoding=None):
+    ''' Pack each item from a list into the chunked-up format and add the
+    byte length of the packed bytes in an initial numeric header. Returns a
+    bytearray, written in one go, that can be sent as-is. '''
+    return _pack_buffer(item_list, True, encoding)
+
+
+def _pack_buffer(item_list, length_header, encoding):
+    ''' Pack item_list into a preallocated bytearray, preceded by a numeric
+    header containing its byte length if length_header is True.
+    A first pass measures every (nested) list, so that the second pass
+    can write each item exactly once at its final position. '''
+    encoding = encoding or BYTE_ENCODING
+    if not _ascii_compatible(encoding):
+        msg = pack(item_list)
+        if length_header:
+            msg_bytes = msg.encode(encoding)
+            msg = _ITEM_ENCODING % (len(msg_bytes), _SEPARATOR, msg)
+        return bytearray(msg.encode(encoding))
+
+    sizes = []
+    chars, byte_length = _measure(item_list, sizes, encoding)
+    header = length_header and _length_header(byte_length) or b''
+    buf = bytearray(len(header) + byte_length)
+    buf[0:len(header)] = header
+    _write(item_list, buf, len(header), iter(sizes), encoding)
+    return buf
+
+
+def _measure(item_list, sizes, encoding):
+    ''' Measure the packed length of item_list (recursively if required) in
+    both characters and bytes. The character length of every nested list is
+    appended to sizes, in the order that _write() will need them. '''
+    chars = 1 + len(_length_header(len(item_list))) + 1
+    extra_bytes = 0
+    for item in item_list:
+        if not (type(item) is tuple or isinstance(item, (list, tuple))):
+            item = _as_text(item, encoding)
+            item_chars = len(item)
+            if not _is_ascii(item):
+                extra_bytes += len(item.encode(encoding)) - item_chars
+        else:
+            size_pos = len(sizes)
+            sizes.append(None)
+            item_chars, item_bytes = _measure(item, sizes, encoding)
+            sizes[size_pos] = item_chars
+            extra_bytes += item_bytes - item_chars
+        if item_chars < _MAX_FIXED_LENGTH:
+            chars += item_chars + _FIXED_ITEM_OVERHEAD
+        else:
+            chars += item_chars + len(_length_header(item_chars)) \
+                     + _SEPARATOR_LENGTH
+    return chars, chars + extra_bytes
+
+
+def _write(item_list, buf, pos, sizes, encoding):
+    ''' Write the packed item_list into buf from pos, using the nested list
+    sizes from _measure(). Runs of leaf items are joined and written together.
+    Returns the position after the written bytes. '''
+    headers = _LENGTH_HEADERS
+    pending = [_START_BYTES, _length_header(len(item_list))]
+    for item in item_list:
+        if not (type(item) is tuple or isinstance(item, (list, tuple))):
+            item = _as_text(item, encoding)
+            pending.append(headers.get(len(item))
+                           or _length_header(len(item)))
+            pending.append(item.encode(encoding))
+            pending.append(_SEPARATOR_BYTES)
+        else:
+            size = next(sizes)
+            pending.append(headers.get(size) or _length_header(size))
+            pos = _flush(buf, pos, pending)
+            pos = _write(item, buf, pos, sizes, encoding)
+            pending = [_SEPARATOR_BYTES]
+    pending.append(_END_BYTES)
+    return _flush(buf, pos, pending)
+
+
+def _flush(buf, pos, pending):
+    ''' Write the pending bytes into buf at pos, returning the end pos '''
+    packed = six.binary_type().join(pending)
+    end = pos + len(packed)
+    buf[pos:end] = packed
+    return end
+
+
+def _as_text(item, encoding):
+    ''' Ensure item is a (unicode) text string '''
+    if type(item) is six.text_type:
+        return item
+    if isinstance(item, six.binary_type):
+        return item.decode(encoding, 'replace')
+    if isinstance(item, six.text_type):
+        return item
+    raise TypeError('%r is not a string' % item)
+
+
+_START_BYTES, _SEPARATOR_BYTES, _END_BYTES = [
+    mark.encode('ascii') for mark in _TEXT_MARKS]
+_LENGTH_HEADERS = {}
+_MAX_FIXED_LENGTH = 10 ** _NUMERIC_LENGTH
+_FIXED_ITEM_OVERHEAD = _NUMERIC_BLOCK_LENGTH + _SEPARATOR_LENGTH
+_MAX_CACHED_LENGTH_HEADER = 4096
+
+
+def _length_header(length):
+    ''' The numeric length header bytes (with separator) for length '''
+    try:
+        return _LENGTH_HEADERS[length]
+    except KeyError:
+        header = (_NUMERIC_ENCODING % length + _SEPARATOR).encode('ascii')
+        if length < _MAX_CACHED_LENGTH_HEADER:
+            _LENGTH_HEADERS[length] = header
+        return header
+
+
+class StreamingResults(Results):
+    ''' Results that are packed as each one is collected, into a buffer that
+    is spilled to a temporary file once it holds more than SPILL_THRESHOLD
+    bytes - so that huge outputs do not have to be held in memory, and the
+    response is ready to send as soon as the last result is in. The
+    response is then sent in chunks(), with one length header.
+    Only byte encodings that are ascii-compatible (see unpack_bytes) can be
+    packed like this: with any other, results are collected as usual. '''
+    __slots__ = ('_encoding', '_count', '_spill')
+
+    def __init__(self, *args, **kwargs):
+        ''' Set up the (empty) buffer, with room for the headers '''
+        Results.__init__(self, *args, **kwargs)
+        self._encoding = BYTE_ENCODING
+        self._count = 0
+        self._spill = None
+        if _ascii_compatible(self._encoding):
+            self._spill = _SpillBuffer(_RESPONSE_PREFIX_LENGTH)
+
+    def _collect(self, instruction_id, str_result):
+        ''' Pack the (string) result of an instruction into the buffer '''
+        if self._spill is None:
+            return Results._collect(self, instruction_id, str_result)
+        item = [instruction_id, str_result]
+        sizes = []
+        chars, byte_length = _measure(item, sizes, self._encoding)
+        header = _length_header(chars)
+        buf = bytearray(len(header) + byte_length + _SEPARATOR_LENGTH)
+        buf[0:len(header)] = header
+        end = _write(item, buf, len(header), iter(sizes), self._encoding)
+        buf[end:] = _SEPARATOR_BYTES
+        self._spill.write(buf)
+        self._count += 1
+
+    def include(self, deferred):
+        ''' Include (packing) the results collected by a deferred() Results'''
+        for instruction_id, str_result in deferred.view():
+            self._collect(instruction_id, str_result)
+
+    def view(self):
+        ''' The results are already packed, so are their own view '''
+        if self._spill is None:
+            return Results.view(self)
+        return self
+
+    def chunks(self):
+        ''' Generate the chunks of bytes of the packed response, including
+        its byte length header. Releases the buffer once done. '''
+        count_header = _length_header(self._count)
+        length = len(_START_BYTES) + len(count_header) + self._spill.size \
+            + len(_END_BYTES)
+        prefix = _length_header(length) + _START_BYTES + count_header
+        try:
+            for chunk in self._spill.chunks(prefix, _END_BYTES):
+                yield chunk
+        finally:
+            self._spill.close()
+
+    def __len__(self):
+        if self._spill is None:
+            return len(self._ids)
+        return self._count
+
+    def __repr__(self):
+        if self._spill is None:
+            return '<%s: %s results>' % (type(self).__name__, len(self))
+        return '<%s: %s results, %s bytes>' % (type(self).__name__,
+                                               self._count,
+                                               self._spill.size)
+
+
+_RESPONSE_PREFIX_LENGTH = len(_length_header(0) + _START_BYTES +
+                              _length_header(0))
+
+
+class _SpillBuffer(object):
+    ''' Buffer of bytes, held in memory until it holds more than threshold
+    bytes and then in a temporary file. Room for a prefix of reserved bytes
+    is kept at the start of the in-memory buffer, so that the prefix can be
+    written in place and everything sent in one go. '''
+
+    def __init__(self, reserved, threshold=None):
+        ''' Specify the prefix bytes to reserve, and the threshold '''
+        self._reserved = reserved
+        self._threshold = threshold or SPILL_THRESHOLD
+        self._memory = bytearray(reserved)
+        self._file = None
+        self.size = 0
+
+    def write(self, data):
+        ''' Append data to the buffer '''
+        self.size += len(data)
+        if self._file is not None:
+            self._file.write(data)
+            return
+        self._memory += data
+        if self.size > self._threshold:
+            self._file = tempfile.TemporaryFile()
+            self._file.write(memoryview(self._memory)[self._reserved:])
+            self._memory = None
+
+    def chunks(self, prefix, suffix):
+        ''' Generate the buffered bytes as chunks, between prefix and
+        suffix - in a single chunk, if the buffer is held in memory and the
+        prefix fits in the space reserved for it '''
+        if self._file is None:
+            memory = self._memory
+            if len(prefix) == self._reserved:
+                memory[0:self._reserved] = prefix
+                memory += suffix
+                yield memory
+            else:
+                yield prefix
+                yield memoryview(memory)[self._reserved:]
+                yield suffix
+            return
+        yield prefix
+        self._file.seek(0)
+        while True:
+            chunk = self._file.read(BUFFER_SIZE)
+            if not chunk:
+                break
+            yield chunk
+        yield suffix
+
+    def close(self):
+        ''' Release the memory or temporary file '''
+        self._memory = None
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+
+def execute_message(message, instructions, execution_context, new_result):
+    ''' Unpack the instructions in a received message, execute them in the
+    execution_context and return the collected results (as a no-copy view,
+    ready to be packed, if new_result supports it) '''
+    result = new_result()
+    instrumentation = getattr(execution_context, 'instrumentation', None)
+    if instrumentation is not None:
+        since = instrumentation.mark()
+    try:
+        unpacked = unpack_bytes(message)
+        if instrumentation is not None:
+            since = instrumentation.phase('unpack', since, len(message))
+        instruction_list = instructions(unpacked)
+        instruction_list.execute(execution_context, result)
+    except UnpackingError as error:
+        result.failed(error, error.description())
+    if instrumentation is not None:
+        instrumentation.phase('execute', since)
+    if hasattr(result, 'view'):
+        return result.view()
+    return result.collection()
+
+
+class RequestReader(object):
+    ''' Buffered reader for a request socket. Reads from the socket in large
+    blocks into a reusable buffer, but hands out exactly the number of bytes
+    asked for: any bytes left over belong to the next read. '''
+
+    def __init__(self, request, buffer_size=None):
+        ''' Specify the request socket to read from '''
+        self._request = request
+        self._buffer = bytearray(buffer_size or BUFFER_SIZE)
+        self._view = memoryview(self._buffer)
+        self._start = self._end = 0  # unread bytes are _buffer[_start:_end]
+
+    def read(self, length):
+        ''' Read exactly length bytes, blocking until they have arrived.
+        Reads larger than the buffer are received straight into a bytearray
+        of the required size, so are never read beyond their length. '''
+        if length > len(self._buffer):
+            return self._read_unbuffered(length)
+        while self._end - self._start < length:
+            self._fill()
+        start = self._start
+        self._start += length
+        return self._view[start:self._start].tobytes()
+
+    def _fill(self):
+        ''' Receive the next block of bytes, after moving any unread bytes
+        to the start of the buffer if there is no room left after them '''
+        if self._start == self._end:
+            self._start = self._end = 0
+        elif self._end == len(self._buffer):
+            unread = self._view[self._start:self._end].tobytes()
+            self._buffer[0:len(unread)] = unread
+            self._start, self._end = 0, len(unread)
+        received = self._request.recv_into(self._view[self._end:])
+        if not received:
+            raise EOFError('Connection closed with %s bytes unread' %
+                           (self._end - self._start))
+        self._end += received
+
+    def _read_unbuffered(self, length):
+        ''' Read exactly length bytes, starting with any unread bytes '''
+        data = bytearray(length)
+        view = memoryview(data)
+        pos = self._end - self._start
+        view[0:pos] = self._view[self._start:self._end]
+        self._start = self._end = 0
+        while pos < length:
+            received = self._request.recv_into(view[pos:], length - pos)
+            if not received:
+                raise EOFError('Connection closed with %s of %s bytes read' %
+                               (pos, length))
+            pos += received
+        return data
+
+
 class RequestResponder(object):
     ''' Mixin class for responding to Slim requests.
     Logic mostly reverse engineered from Java test classes especially
     fitnesse.responders.run.slimResponder.SlimTestSystemTest '''
+    _debugging = False
 
     def respond_to_request(self,
                            instructions=Instructions,
                            execution_context=ExecutionContext,
-                           results=Results):
+                           results=StreamingResults):
         ''' Entry point for mixin: respond to a Slim protocol request.
         Basic format of every interaction is:
         - every request requires an initial ACK with the Slim Version
         - messages can then be received and responses sent, in a loop
         - receiving a 'bye' message will terminate the loop
         '''
+        self._debugging = self.debug_enabled()
         ack_bytes = self._send_ack(self.request)
+        self._reader = RequestReader(self.request)
         context = execution_context()
-        received, sent = self._message_loop(instructions,
-                                            context,
-                                            results)
+        try:
+            received, sent = self._message_loop(instructions,
+                                                context,
+                                                results)
+            if self._debugging and hasattr(context, 'resolution_stats'):
+                self.debug('Method resolution: %s' %
+                           context.resolution_stats())
+        finally:
+            try:
+                if getattr(context, 'instrumentation', None) is not None:
+                    context.instrumentation.session_ended()
+            finally:
+                if hasattr(context, 'close'):
+                    context.close()
         return received, sent + ack_bytes
 
     def _send_ack(self, request):
         ''' Acknowledge the request by sending the Slim Version '''
         response = _VERSION.encode(BYTE_ENCODING)
-        self.debug('Send Ack')
-        return request.send(response)
+        if self._debugging:
+            self.debug('Send Ack')
+        request.sendall(response)
+        return len(response)
 
     def _message_loop(self, instructions, execution_context, new_result):
         ''' Receive messages from the request and send responses.
@@ -167,29 +602,46 @@ class RequestResponder(object):
         of the message contents. The message contents can then be read,
         their instructions executed, and the results returned.'''
         received, sent = 0, 0
+        disconnect = _DISCONNECT.encode(BYTE_ENCODING)
+        instrumentation = getattr(execution_context, 'instrumentation', None)
 
         while True:
             message_length, bytes_received = self._get_message_length()
-            self.debug('Next message %s bytes' % message_length)
+            if self._debugging:
+                self.debug('Next message %s bytes' % message_length)
             received += bytes_received
+            if instrumentation is not None:
+                since = instrumentation.mark()
 
             message = self._get_message(message_length)
             received += message_length
 
-            if _DISCONNECT == message:
+            if disconnect == message:
                 break
-
-            result = new_result()
-            try:
-                instruction_list = instructions(unpack(message))
-                instruction_list.execute(execution_context, result)
-            except UnpackingError as error:
-                result.failed(error, error.description())
-
-            results = result.collection()
-            self.debug('Results: %r' % results)
-            formatted_response = self._format_response(pack(results))
-            sent += self.request.send(formatted_response)
+            if instrumentation is not None:
+                instrumentation.phase('recv', since,
+                                      bytes_received + message_length)
+
+            results = execute_message(message, instructions,
+                                      execution_context, new_result)
+            if self._debugging:
+                self.debug('Results: %r' % results)
+            if instrumentation is not None:
+                since = instrumentation.mark()
+            if hasattr(results, 'chunks'):
+                # already packed as collected: counted under 'execute'
+                response = results.chunks()
+            else:
+                response = [self._format_response(results)]
+                if instrumentation is not None:
+                    since = instrumentation.phase('pack', since)
+            sent_now = 0
+            for chunk in response:
+                self.request.sendall(chunk)
+                sent_now += len(chunk)
+            sent += sent_now
+            if instrumentation is not None:
+                instrumentation.phase('send', since, sent_now)
 
         return received, sent
 
@@ -197,29 +649,23 @@ class RequestResponder(object):
         ''' Get the length of the message from an initial numeric header '''
         header_format = (_NUMERIC_ENCODING % 0) + _SEPARATOR
         byte_size = len(header_format.encode(BYTE_ENCODING))
-        data = self.request.recv(byte_size).decode(BYTE_ENCODING)
+        data = self._reader.read(byte_size).decode(BYTE_ENCODING)
         length = int(data[0:_NUMERIC_LENGTH])
         return length, byte_size
 
     def _get_message(self, message_length):
-        ''' Receive a message of a known length, in parts'''
-        parts = []
-        remaining = message_length
-        while remaining > 0:
-            # Try 1k to work around incorrect message_length with utf-8
-            data = self.request.recv(BUFFER_SIZE)
-            received = len(data)
-            self.debug('Recv %s bytes...' % received)
-            parts.append(data)
-            remaining -= received
-        return six.binary_type().join(parts).decode(BYTE_ENCODING)
-
-    def _format_response(self, msg):
-        ''' Encode the bytes and add the length in an initial numeric header'''
-        msg_bytes = msg.encode(BYTE_ENCODING)
-        response_str = _ITEM_ENCODING % (len(msg_bytes), _SEPARATOR, msg)
-        return response_str.encode(BYTE_ENCODING)
+        ''' Receive the bytes of a message of a known (byte) length '''
+        return self._reader.read(message_length)
+
+    def _format_response(self, results):
+        ''' Pack the results to bytes with the length in a numeric header'''
+        return pack_message(results)
 
     def debug(self, msg):
         ''' log a debug msg '''
         pass
+
+    def debug_enabled(self):
+        ''' Whether debug() msgs will be logged: checked once per request,
+        so that msgs are not even built unless they will be logged '''
+        return False
@@ -15,8 +15,31 @@ Run this module to start the WaferSlimServer listening on a host / port:
                                  (default: utf-8)
      -v, --verbose               log verbose messages at runtime
                                  (default: False)
+     -q, --quiet                 no debug or info logging at all: only
+                                 warnings and errors (overrides --verbose)
      -l FILE, --logconf=...      use logging configuration from FILE
      -s PATH, --syspath=...      add entries from PATH to sys.path
+     --persistent                keep serving sessions after the first one
+                                 ends, reusing already-loaded fixtures
+     -w N, --workers=...         pre-fork N worker processes sharing the
+                                 listening socket (POSIX only); only the
+                                 --preload fixtures are imported up front
+     --preload=PATHS             import the comma-separated fixture PATHS
+                                 before forking --workers
+     -a, --async                 serve many concurrent sessions from one
+                                 long-lived asyncio server (python 3.7+)
+     -t THREADS, --threads=...   run fixture code for at most THREADS
+                                 sessions at a time in --async mode
+                                 (default: 8)
+     --snapshot=FILE             keep a snapshot of fixture class metadata
+                                 in FILE, to speed up later starts
+     --instrument=FILE           append a JSON report of the timings of
+                                 each session to FILE
+     --profile=METHODS           profile calls of the comma-separated
+                                 fixture METHODS ("method" or "Class.method")
+     --typed-symbols             keep the values assigned to symbols as-is,
+                                 passing them directly to convert_arg
+                                 methods that convert to the same type
 
     A "trailing" numeric value is assumed to be a port number
     if no explicit PORT is specified, so the following are equivalent
@@ -29,15 +52,23 @@ The latest source code is available at http://code.launchpad.net/waferslim.
 Copyright 2009-2010 by the author(s). All rights reserved
 '''
 import codecs
+import errno
 import logging.config
 import os
+import select
+import signal
+import socket
 import sys
+import threading
 try:
     import SocketServer
 except ImportError:
     import socketserver as SocketServer
 from optparse import OptionParser
-from . import protocol
+from . import instrumentation, protocol
+from . import execution
+from .execution import (ExecutionContext, FixtureCache, FixtureSnapshot,
+                        MODULE_CACHE)
 
 
 _LOGGER_NAME = 'WaferSlimServer'
@@ -52,12 +83,16 @@ class SlimRequestHandler(SocketServer.BaseRequestHandler,
 
     def handle(self):
         ''' log some info about the request then pass off to mixin class '''
-        from_addr = '%s:%s' % self.client_address
-        self.info('Handling request from %s' % from_addr)
+        logging_on = not execution.NO_LOGGING
+        if logging_on:
+            from_addr = '%s:%s' % self.client_address
+            self.info('Handling request from %s' % from_addr)
         try:
-            received, sent = self.respond_to_request()
-            done_msg = 'Done with %s: %s bytes received, %s bytes sent'
-            self.info(done_msg % (from_addr, received, sent))
+            received, sent = self.respond_to_request(
+                execution_context=self.server.new_execution_context)
+            if logging_on:
+                done_msg = 'Done with %s: %s bytes received, %s bytes sent'
+                self.info(done_msg % (from_addr, received, sent))
         except Exception as error:
             logging.error(error, exc_info=1)
         self.server.done(self)
@@ -70,21 +105,31 @@ class SlimRequestHandler(SocketServer.BaseRequestHandler,
         ''' log a debug msg - present in this class to allow use from mixin'''
         logging.getLogger(_LOGGER_NAME).debug(msg)
 
+    def debug_enabled(self):
+        ''' whether debug msgs will be logged - used from mixin '''
+        return execution.debug_enabled(logging.getLogger(_LOGGER_NAME))
+
 
 class WaferSlimServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
     ''' Standard python library threaded TCP socket server __init__-ed
-    to delegate request handling to SlimRequestHandler '''
+    to delegate request handling to SlimRequestHandler.
+    Serving blocks until there is a connection to accept or shutdown() is
+    called, rather than polling: an embedding process can use start() and
+    stop() to host the server in a background thread. '''
 
     def __init__(self, options):
         ''' Initialise socket server on host and port, with logging '''
-        if options.verbose:
-            for name in _ALL_LOGGER_NAMES:
-                logging.getLogger(name).setLevel(logging.DEBUG)
-
-        if not hasattr(self, 'shutdown'):  # only introduced in 2.6
-            self._up = [True]
-            self.shutdown = lambda: self._up and self._up.pop() or self._up
-            self.serve_forever = self._serve_until_shutdown
+        _setup_verbosity(options)
+        self.persistent = getattr(options, 'persistent', False)
+        self.fixture_cache = self.persistent and FixtureCache() or None
+        self.instrument = (getattr(options, 'instrument', ''),
+                           getattr(options, 'profile', ''))
+        self.typed_symbols = getattr(options, 'typed_symbols', False)
+        self._shutdown_request = threading.Event()
+        self._is_shut_down = threading.Event()
+        self._is_shut_down.set()
+        self._wakeup = _socketpair()
+        self._thread = None
 
         prestart_msg = "Starting server with options: %s" % (options,)
         logging.getLogger(_LOGGER_NAME).info(prestart_msg)
@@ -94,16 +139,213 @@ class WaferSlimServer(SocketServer.ThreadingMixIn, SocketServer.TCPServer):
         start_msg = "Started and listening on %s:%s" % self.server_address
         logging.getLogger(_LOGGER_NAME).info(start_msg)
 
+    def new_execution_context(self):
+        ''' Create the ExecutionContext for a new request - in persistent
+        mode every context shares the server's fixture_cache '''
+        return ExecutionContext(
+            fixture_cache=self.fixture_cache,
+            instrumentation=instrumentation.for_session(*self.instrument),
+            typed_symbols=self.typed_symbols)
+
     def done(self, request_handler):
-        ''' A request_handler has completed - shut down the server'''
+        ''' A request_handler has completed - shut down the server, unless
+        it is persistent'''
+        if self.persistent:
+            return
         logging.getLogger(_LOGGER_NAME).info('Shutting down')
         self.shutdown()
 
-    def _serve_until_shutdown(self):
-        ''' Handle requests until shutdown is called '''
-        self.handle_request()
-        while self._up:
+    def serve_forever(self, poll_interval=None):
+        ''' Handle requests until shutdown is called. Waits on both the
+        listening socket and a wakeup socket written to by shutdown(), so
+        there is no need to poll (unless no socketpair can be created) '''
+        if self._wakeup is None:
+            poll_interval = poll_interval or _FALLBACK_POLL_INTERVAL
+            waiting_on = [self]
+        else:
+            waiting_on = [self, self._wakeup[0]]
+            _drain(self._wakeup[0])  # left by an earlier shutdown()
+        self._is_shut_down.clear()
+        try:
+            while not self._shutdown_request.is_set():
+                readable = _select(waiting_on, poll_interval)
+                if self._shutdown_request.is_set():
+                    break
+                if len(waiting_on) > 1 and waiting_on[1] in readable:
+                    _drain(waiting_on[1])
+                if self in readable:
+                    self._handle_request_noblock()
+        finally:
+            self._shutdown_request.clear()
+            self._is_shut_down.set()
+
+    def shutdown(self):
+        ''' Stop the serve_forever loop, blocking until it has stopped.
+        Must be called from a different thread to serve_forever. '''
+        self._shutdown_request.set()
+        if self._wakeup is not None:
+            self._wakeup[1].send(b'x')
+        self._is_shut_down.wait()
+
+    def start(self):
+        ''' Serve requests from a background thread, returning the thread'''
+        self._thread = threading.Thread(target=self.serve_forever,
+                                        name='WaferSlimServer')
+        self._thread.daemon = True
+        self._thread.start()
+        return self._thread
+
+    def stop(self):
+        ''' Stop serving requests started with start(), then close the
+        server '''
+        self.shutdown()
+        if self._thread is not None:
+            self._thread.join()
+            self._thread = None
+        self.server_close()
+
+    def server_close(self):
+        ''' Close the listening socket and the wakeup socketpair '''
+        SocketServer.TCPServer.server_close(self)
+        if self._wakeup is not None:
+            for wakeup_socket in self._wakeup:
+                wakeup_socket.close()
+            self._wakeup = None
+
+
+_FALLBACK_POLL_INTERVAL = 0.5
+
+
+def _socketpair():
+    ''' A connected pair of sockets, or None where that is unsupported.
+    The first (the one read from) is non-blocking, so it can be drained. '''
+    try:
+        pair = socket.socketpair()
+    except (AttributeError, OSError):
+        return None
+    pair[0].setblocking(False)
+    return pair
+
+
+def _drain(wakeup_socket):
+    ''' Read (and discard) everything written to a non-blocking socket '''
+    try:
+        while wakeup_socket.recv(512):
+            pass
+    except socket.error as error:
+        if error.args[0] not in (errno.EAGAIN, errno.EWOULDBLOCK):
+            raise
+
+
+def _select(waiting_on, timeout):
+    ''' Wait (for up to timeout seconds, if specified) until any of the
+    sockets waiting_on is readable, returning those that are '''
+    while True:
+        try:
+            return select.select(waiting_on, [], [], timeout)[0]
+        except (OSError, select.error) as error:
+            if error.args[0] != errno.EINTR:  # retried from 3.5 anyway
+                raise
+
+
+class PreForkSlimServer(WaferSlimServer):
+    ''' Pre-fork server, so that CPU-bound fixtures can use every core.
+    Fixture paths to --preload are imported in this (parent) process, which
+    then forks a number of persistent worker processes that share both its
+    listening socket and (copy-on-write) its loaded fixtures. Directories on
+    --syspath are only added to sys.path, not imported: fixtures that are
+    not listed in --preload are imported by each worker on first use. Each
+    worker serves one session at a time; workers that exit are replaced.
+    Only available where os.fork() is. '''
+
+    process_request = SocketServer.TCPServer.process_request
+
+    def __init__(self, options):
+        ''' Initialise socket server and preload fixtures '''
+        WaferSlimServer.__init__(self, options)
+        self.persistent = True
+        self.fixture_cache = FixtureCache()
+        self._workers = int(options.workers)
+        self._worker_pids = set()
+        self._stopping = False
+        for path in getattr(options, 'preload', '').split(','):
+            if path.strip():
+                logging.getLogger(_LOGGER_NAME).info('Preloading %s' % path)
+                self.fixture_cache.load_classes(path.strip())
+
+    def serve_forever(self, *args):
+        ''' Fork the workers, replacing any that exit, until shutdown '''
+        try:
+            previous_handler = signal.signal(signal.SIGTERM,
+                                             lambda *args: self.shutdown())
+        except ValueError:  # not the main thread
+            previous_handler = None
+        try:
+            while len(self._worker_pids) < self._workers:
+                self._fork_worker(*args)
+            while self._worker_pids:
+                for pid, status in self._exited_workers():
+                    self._worker_pids.discard(pid)
+                    if not self._stopping:
+                        logging.getLogger(_LOGGER_NAME).warning(
+                            'Worker %s exited with status %s' % (pid, status))
+                        self._fork_worker(*args)
+        finally:
+            self.shutdown()
+            if previous_handler is not None:
+                signal.signal(signal.SIGTERM, previous_handler)
+
+    def _exited_workers(self):
+        ''' Wait for a worker to exit, then return the (pid, status) of each
+        worker known to have exited - with a status of None for any that
+        had already been reaped elsewhere, so cannot be waited for '''
+        try:
+            pid, status = os.waitpid(-1, 0)
+        except OSError as error:
+            if error.errno == errno.EINTR:  # retried from 3.5 anyway
+                return []
+            if error.errno != errno.ECHILD:
+                raise
+        else:
+            return pid in self._worker_pids and [(pid, status)] or []
+        exited = []
+        for pid in list(self._worker_pids):
+            try:
+                os.waitpid(pid, os.WNOHANG)
+            except OSError as error:
+                if error.errno != errno.ECHILD:
+                    raise
+                exited.append((pid, None))
+        return exited
+
+    def _fork_worker(self, *args):
+        ''' Fork a worker process to serve sessions on the shared socket '''
+        pid = os.fork()
+        if pid:
+            self._worker_pids.add(pid)
+            return
+        status = 0
+        try:
+            signal.signal(signal.SIGTERM, signal.SIG_DFL)
+            logging.getLogger(_LOGGER_NAME).info('Worker %s started' %
+                                                 os.getpid())
+            WaferSlimServer.serve_forever(self, *args)
+        except KeyboardInterrupt:
             pass
+        except Exception as error:
+            logging.error(error, exc_info=1)
+            status = 1
+        finally:
+            os._exit(status)
+
+    def shutdown(self):
+        ''' Stop all the worker processes '''
+        self._stopping = True
+        for pid in list(self._worker_pids):
+            try:
+                os.kill(pid, signal.SIGTERM)
+            except OSError:  # already exited
+                self._worker_pids.discard(pid)
 
 
 def _get_options():
@@ -121,15 +363,68 @@ def _get_options():
     parser.add_option('-v', '--verbose', dest='verbose',
                       default=False, action='store_true',
                       help='log verbose messages at runtime (default: False)')
+    parser.add_option('-q', '--quiet', dest='quiet',
+                      default=False, action='store_true',
+                      help='no debug or info logging at all: only warnings '
+                           'and errors (overrides --verbose)')
     parser.add_option('-l', '--logconf', dest='logconf',
                       metavar='CONFIGFILE', default='',
                       help='use logging configuration from CONFIGFILE')
     parser.add_option('-s', '--syspath', dest='syspath',
                       metavar='SYSPATH', default='',
                       help='add entries from SYSPATH to sys.path')
+    parser.add_option('--persistent', dest='persistent',
+                      default=False, action='store_true',
+                      help='keep serving sessions after the first one ends, '
+                           'reusing already-loaded fixtures')
+    parser.add_option('-w', '--workers', dest='workers',
+                      metavar='WORKERS', default=0, type='int',
+                      help='pre-fork WORKERS worker processes sharing the '
+                           'listening socket (POSIX only); only --preload '
+                           'fixtures are imported before forking')
+    parser.add_option('--preload', dest='preload',
+                      metavar='PATHS', default='',
+                      help='import the comma-separated fixture PATHS '
+                           'before forking --workers')
+    parser.add_option('-a', '--async', dest='asynchronous',
+                      default=False, action='store_true',
+                      help='serve many concurrent sessions from one '
+                           'long-lived asyncio server (python 3.7+)')
+    parser.add_option('-t', '--threads', dest='threads',
+                      metavar='THREADS', default=8, type='int',
+                      help='run fixture code for at most THREADS sessions '
+                           'at a time in --async mode (default: 8)')
+    parser.add_option('--instrument', dest='instrument',
+                      metavar='FILE', default='',
+                      help='append a JSON report of the timings of each '
+                           'session to FILE')
+    parser.add_option('--profile', dest='profile',
+                      metavar='METHODS', default='',
+                      help='profile calls of the comma-separated fixture '
+                           'METHODS ("method" or "Class.method")')
+    parser.add_option('--snapshot', dest='snapshot',
+                      metavar='FILE', default='',
+                      help='keep a snapshot of fixture class metadata in '
+                           'FILE, to speed up later starts')
+    parser.add_option('--typed-symbols', dest='typed_symbols',
+                      default=False, action='store_true',
+                      help='keep the values assigned to symbols as-is, '
+                           'passing them directly to convert_arg methods '
+                           'that convert to the same type')
     return parser.parse_args()
 
 
+def _setup_verbosity(options):
+    ''' Log verbose messages at runtime if requested - or, in quiet mode,
+    nothing below warnings, skipping debug logging entirely '''
+    if getattr(options, 'quiet', False):
+        execution.NO_LOGGING = True
+        logging.disable(logging.INFO)
+    elif options.verbose:
+        for name in _ALL_LOGGER_NAMES:
+            logging.getLogger(name).setLevel(logging.DEBUG)
+
+
 def _setup_logging(options):
     ''' Configure standard logging package '''
     if os.path.exists(options.logconf):
@@ -146,6 +441,12 @@ def _setup_syspath(options):
         sys.path.append(element)
 
 
+def _setup_snapshot(options):
+    ''' Configure the fixture metadata snapshot, if one is to be used '''
+    if options.snapshot:
+        MODULE_CACHE.snapshot = FixtureSnapshot(options.snapshot)
+
+
 def _setup_encoding(options):
     ''' Configure byte (de-)encoding to use '''
     if codecs.lookup(options.encoding):
@@ -169,9 +470,16 @@ def start_server():
 
     _setup_logging(options)
     _setup_syspath(options)
+    _setup_snapshot(options)
     _setup_encoding(options)
     _setup_port(options, args)
-    WaferSlimServer(options).serve_forever()
+    if options.asynchronous:
+        from .asyncio_server import AsyncSlimServer
+        AsyncSlimServer(options).serve_forever()
+    elif options.workers:
+        PreForkSlimServer(options).serve_forever()
+    else:
+        WaferSlimServer(options).serve_forever()
 
 
 if __name__ == '__main__':
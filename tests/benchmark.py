@@ -0,0 +1,47 @@
+'''
+Benchmark of the datetime converters: the time to convert (from_string and
+to_string) iso-standard values, compared with strptime() and str(). Run with
+    python -m waferslim.tests.benchmark
+'''
+import datetime
+import timeit
+from waferslim import converters
+
+NUMBER = 100000
+
+BENCHMARKS = (
+    ('date', converters.DateConverter(), '2009-02-28',
+     converters.DateConverter.DATE_FORMAT),
+    ('time', converters.TimeConverter(), '21:54:32.987654',
+     converters.TimeConverter.TIME_FORMAT_WITH_MICROSECONDS),
+    ('time (no micros)', converters.TimeConverter(), '21:54:32',
+     converters.TimeConverter.TIME_FORMAT_WITHOUT_MICROSECONDS),
+    ('datetime', converters.DatetimeConverter(), '2009-02-28 21:54:32.987654',
+     converters.DatetimeConverter.FORMAT_WITH_MICROSECONDS),
+    ('datetime (no micros)', converters.DatetimeConverter(),
+     '2009-02-28 21:54:32',
+     converters.DatetimeConverter.FORMAT_WITHOUT_MICROSECONDS),
+)
+
+
+def best_of(function, number=NUMBER):
+    ''' Best time (in seconds) taken to call function number times '''
+    return min(timeit.repeat(function, number=number, repeat=3))
+
+
+def main():
+    strptime = datetime.datetime.strptime
+    print('%-22s %10s %10s %10s %10s' % ('', 'strptime', 'from_str',
+                                         'str()', 'to_str'))
+    for name, converter, value, format in BENCHMARKS:
+        typed = converter.from_string(value)
+        print('%-22s %10.3f %10.3f %10.3f %10.3f' % (
+            name,
+            best_of(lambda: strptime(value, format)),
+            best_of(lambda: converter.from_string(value)),
+            best_of(lambda: str(typed)),
+            best_of(lambda: converter.to_string(typed))))
+
+
+if __name__ == '__main__':
+    main()
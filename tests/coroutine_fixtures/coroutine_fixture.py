@@ -0,0 +1,24 @@
+import asyncio
+
+
+class CoroutineFixture(object):
+    meeting = 0
+
+    def __init__(self):
+        self.calls = []
+
+    async def meet(self, value):
+        CoroutineFixture.meeting -= 1
+        for attempt in range(200):
+            if CoroutineFixture.meeting <= 0:
+                return value
+            await asyncio.sleep(0.01)
+        return 'alone'
+
+    async def slow_echo(self, value):
+        await asyncio.sleep(0.2)
+        self.calls.append(value)
+        return value
+
+    async def event_loop(self):
+        return str(id(asyncio.get_event_loop()))
@@ -1,5 +1,17 @@
+import datetime
+import json
+import logging
+import optparse
+import os
+import shutil
+import socket
+import sys
+import tempfile
+import threading
+import time
 import unittest
-from waferslim import execution
+from waferslim import (converters, execution, instrumentation, protocol,
+                       server)
 from waferslim.tests.fixtures import echo_fixture
 
 
@@ -74,5 +86,992 @@ class GetClassesTestCase(unittest.TestCase):
         )
 
 
+class ExecuteInstructions(object):
+    ''' Mixin to execute instructions in self.context, and get the results '''
+    def execute(self, *instructions):
+        results = execution.Results()
+        execution.Instructions([list(i) for i in instructions]).execute(
+            self.context, results)
+        return results.collection()
+
+
+class ResolveTargetTestCase(ExecuteInstructions, unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.context.import_path('waferslim.tests.fixtures')
+        self.echoer = echo_fixture.EchoFixture()
+        self.context.store_instance('echoer', self.echoer)
+
+    def test_plain_method_resolved_once(self):
+        for i in range(3):
+            function, pass_instance = self.context.resolve_target(
+                self.echoer, 'echo')
+            self.assertTrue(pass_instance)
+            self.assertEqual(function(self.echoer, 'x'), 'x')
+        self.assertEqual(self.context.resolution_stats(),
+                         {'hits': 2, 'misses': 1, 'hit_rate': 2.0 / 3})
+
+    def test_other_methods_resolved_by_getattr(self):
+        for name in ('staticEcho', 'class_echo'):
+            function, pass_instance = self.context.resolve_target(
+                self.echoer, name)
+            self.assertFalse(pass_instance)
+            self.assertEqual(function('x'), 'x')
+
+    def test_instance_attribute_overrides_method(self):
+        self.echoer.echo = lambda value: value.upper()
+        self.assertEqual(self.context.target_for(self.echoer, 'echo')('x'),
+                         'X')
+
+    def test_calls_resolved_once_each(self):
+        self.execute(['1', 'call', 'echoer', 'echo', 'a'],
+                     ['2', 'call', 'echoer', 'echo', 'b'],
+                     ['3', 'call', 'echoer', 'echo', 'c'])
+        self.assertEqual(self.context.resolution_stats(),
+                         {'hits': 2, 'misses': 1, 'hit_rate': 2.0 / 3})
+
+    def test_missing_method_fails_only_its_call(self):
+        self.assertEqual(
+            self.execute(['1', 'call', 'echoer', 'noSuchMethod', 'x'],
+                         ['2', 'call', 'echoer', 'echo', 'a']),
+            [['1', '__EXCEPTION__: message:<<noSuchMethod>>'], ['2', 'a']])
+
+
+class Unrepresentable(object):
+    def __repr__(self):
+        raise AssertionError('formatted for a disabled debug message')
+
+
+class DebugLoggingTestCase(unittest.TestCase):
+    def test_disabled_messages_not_formatted(self):
+        logger = logging.getLogger('DebugLoggingTestCase')
+        logger.setLevel(logging.INFO)
+        execution._debug(logger, 'Value %r', (Unrepresentable(),))
+        context = execution.ExecutionContext(logger=logger)
+        context.store_instance('unrepresentable', Unrepresentable())
+
+    def test_no_logging_mode(self):
+        logger = logging.getLogger('DebugLoggingTestCase')
+        logger.setLevel(logging.DEBUG)
+        self.assertTrue(execution.debug_enabled(logger))
+        self.addCleanup(setattr, execution, 'NO_LOGGING', False)
+        execution.NO_LOGGING = True
+        self.assertFalse(execution.debug_enabled(logger))
+
+
+class ParamsConverterTestCase(unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.context.store_symbol('x', 'X')
+        self.context.store_symbol('y', 'Y')
+
+    def test_plain_and_nested_params(self):
+        self.assertEqual(
+            self.context.to_args(['a', 'b', ['c', ['$x']], 'd'], 1),
+            ('b', ('c', ('X',)), 'd'))
+
+    def test_symbols_substituted(self):
+        self.assertEqual(self.context.to_args(['$x$y-$z', '$', 'US$5'], 0),
+                         ('XY-$z', '$', 'US$5'))
+
+    def test_every_symbol_substituted(self):
+        self.assertEqual(self.context.to_args(['$x' * 20], 0), ('X' * 20,))
+
+    def test_large_args_not_memoised(self):
+        large = '$x' + ' ' * execution._MAX_MEMOISED_TEMPLATE_LENGTH
+        self.assertEqual(self.context.to_args([large], 0),
+                         ('X' + large[2:],))
+        self.assertFalse(execution._symbol_template(large)
+                         is execution._symbol_template(large))
+
+
+class ListFixture(object):
+    @converters.convert_arg(to_type=int)
+    def make_list(self, size):
+        self.made = [str(i) for i in range(size)]
+        return self.made
+
+    @converters.convert_arg(to_type=list)
+    def is_made(self, values):
+        return values is self.made
+
+    @converters.convert_arg(to_type=str)
+    def describe(self, values):
+        return 'values=%s' % values
+
+    @converters.convert_arg(to_type=tuple)
+    def as_tuple(self, values):
+        return values == tuple(self.made)
+
+
+class TypedSymbolsTestCase(unittest.TestCase):
+    def execute(self, typed_symbols, *instructions):
+        context = execution.ExecutionContext(typed_symbols=typed_symbols)
+        context.classes['ListFixture'] = ListFixture
+        context.store_instance('lists', ListFixture())
+        results = execution.Results()
+        execution.Instructions(
+            [['1', 'callAndAssign', 'x', 'lists', 'makeList', '3']]
+            + list(instructions)).execute(context, results)
+        return context, results.collection()
+
+    def test_typed_value_passed_as_is(self):
+        context, collection = self.execute(
+            True, ['2', 'call', 'lists', 'isMade', '$x'])
+        self.assertEqual(collection, [['1', ['0', '1', '2']], ['2', 'true']])
+        self.assertEqual(context.get_symbol('x'), ['0', '1', '2'])
+
+    def test_typed_value_converted_for_other_types(self):
+        _, collection = self.execute(
+            True, ['2', 'call', 'lists', 'describe', '$x'])
+        self.assertEqual(collection[1], ['2', 'values=[0, 1, 2]'])
+
+    def test_typed_list_converted_to_tuple(self):
+        _, collection = self.execute(
+            True, ['2', 'call', 'lists', 'asTuple', '$x'])
+        self.assertEqual(collection[1], ['2', 'true'])
+
+    def test_typed_value_passed_as_is_on_another_thread(self):
+        collections = []
+        thread = threading.Thread(target=lambda: collections.append(
+            self.execute(True, ['2', 'call', 'lists', 'isMade', '$x'])[1]))
+        thread.start()
+        thread.join()
+        self.assertEqual(collections, [[['1', ['0', '1', '2']], ['2', 'true']]])
+
+    def test_untyped_by_default(self):
+        context, _ = self.execute(False)
+        self.assertEqual(context.get_symbol('x'), ['0', '1', '2'])
+        self.assertEqual(context.get_typed_symbol('x'), None)
+
+
+class ConvertArgTestCase(unittest.TestCase):
+    class Setter(object):
+        @converters.convert_arg(to_type=(int, float))
+        def set_values(self, *values):
+            return values
+
+    def test_converter_per_position(self):
+        self.assertEqual(self.Setter().set_values('1', '2.5'), (1, 2.5))
+        self.assertEqual(self.Setter().set_values('3'), (3,))
+
+    def test_too_many_params(self):
+        self.assertRaises(converters.WaferSlimException,
+                          self.Setter().set_values, '1', '2', '3')
+
+    def test_iterable_converter_per_position(self):
+        converter = converters.IterableConverter(to_type=(int, float))
+        self.assertEqual(converter.from_string('[1, 2]'), (1, 2.0))
+
+
+class ConverterForTestCase(unittest.TestCase):
+    class Values(list):
+        pass
+
+    def test_registered_type(self):
+        self.assertEqual(converters.to_string(42), '42')
+        self.assertEqual(converters.to_string(True), 'true')
+
+    def test_nearest_base_class(self):
+        self.assertEqual(converters.to_string(self.Values([1, 2])),
+                         ['1', '2'])
+        self.assertTrue(converters.converter_for(self.Values)
+                        is converters.converter_for(list))
+
+    def test_default_converter(self):
+        self.assertEqual(converters.to_string(ConverterForTestCase), str(
+            ConverterForTestCase))
+        self.assertTrue(converters.converter_for(object())
+                        is converters.converter_for(object))
+
+    def test_register_converter_resets_resolved(self):
+        original = converters.converter_for(list)
+        self.addCleanup(converters.register_converter, list, original)
+        self.assertEqual(converters.to_string(self.Values(['a'])), ['a'])
+        converters.register_converter(list, converters.Converter())
+        self.assertEqual(converters.to_string(self.Values(['a'])), "['a']")
+
+
+class DatetimeConvertersTestCase(unittest.TestCase):
+    def test_iso_values(self):
+        for converter, value, typed in (
+            (converters.DateConverter(), '2009-02-28',
+             datetime.date(2009, 2, 28)),
+            (converters.TimeConverter(), '21:54:32.987654',
+             datetime.time(21, 54, 32, 987654)),
+            (converters.TimeConverter(), '21:54:32',
+             datetime.time(21, 54, 32)),
+            (converters.DatetimeConverter(), '2009-02-28 21:54:32.987654',
+             datetime.datetime(2009, 2, 28, 21, 54, 32, 987654)),
+            (converters.DatetimeConverter(), '2009-02-28 21:54:32',
+             datetime.datetime(2009, 2, 28, 21, 54, 32))):
+            self.assertEqual(converter.from_string(value), typed)
+            self.assertEqual(converter.to_string(typed), value)
+
+    def test_fraction_of_second(self):
+        self.assertEqual(converters.TimeConverter().from_string('01:02:03.5'),
+                         datetime.time(1, 2, 3, 500000))
+
+    def test_strptime_fallback(self):
+        self.assertEqual(converters.DateConverter().from_string('2009-2-8'),
+                         datetime.date(2009, 2, 8))
+        self.assertEqual(
+            converters.DatetimeConverter().from_string('2009-02-28 1:2:3'),
+            datetime.datetime(2009, 2, 28, 1, 2, 3))
+
+    def test_invalid_values(self):
+        for value in ('2009-02-30', '2009-02-28\n', '2009-02-28T00:00:00'):
+            self.assertRaises(ValueError,
+                              converters.DateConverter().from_string, value)
+        self.assertRaises(ValueError,
+                          converters.TimeConverter().from_string, '24:00:00')
+
+
+class IterableConverterTestCase(unittest.TestCase):
+    def test_bulk_from_string(self):
+        for to_type, value, expected in (
+            (int, '[1, -2 ,3 ]', (1, -2, 3)),
+            (float, '[1, -2 ,3.5 ]', (1.0, -2.0, 3.5)),
+            (bool, '[true, no ,True ]', (True, False, True)),
+            (None, '[1, -2 ,3.5 ]', ('1', '-2', '3.5'))):
+            converter = converters.IterableConverter(to_type=to_type)
+            self.assertEqual(converter.from_string(value), expected)
+
+    def test_to_string_mixed_types(self):
+        self.assertEqual(
+            converters.to_string([1, 2.5, True, 'x', int, [3, False]]),
+            ['1', '2.5', 'true', 'x', str(int), ['3', 'false']])
+
+
+class DictConverterTestCase(unittest.TestCase):
+    MARKUP = '''<table class="hash_table">
+        <tr class="hash_row">
+            <td class="hash_key">name</td>
+            <td class="hash_value">Bob</td>
+        </tr>
+        <TR><TD>address</TD><TD><table><tr><td>city</td><td>Leeds</td></tr>
+        </table></TD></TR>
+    </table>'''
+
+    def test_from_string(self):
+        self.assertEqual(converters.DictConverter().from_string(self.MARKUP), {
+            'name': 'Bob',
+            'address': '''<table><tr><td>city</td><td>Leeds</td></tr>
+        </table>'''})
+
+    def test_nested_conversion(self):
+        converter = converters.DictConverter(
+            {'address': converters.DictConverter()})
+        self.assertEqual(converter.from_string(self.MARKUP)['address'],
+                         {'city': 'Leeds'})
+
+    def test_round_trip(self):
+        converter = converters.DictConverter({'id': int})
+        a_dict = {'id': 7, 'name': 'Bob', 'tags': {'a': 'b'}}
+        markup = converter.to_string(a_dict)
+        self.assertTrue(markup.startswith('<table class="hash_table"><tr '))
+        self.assertEqual(converter.from_string(markup), {
+            'id': 7, 'name': 'Bob', 'tags': converter.to_string({'a': 'b'})})
+
+
+class LazyAliasesTestCase(unittest.TestCase):
+    def test_aliases_generated_on_first_use(self):
+        context = execution.ExecutionContext()
+        context.import_path('waferslim.tests.fixtures')
+        self.assertEqual(context.aliases, {})
+        aliases = context.aliases_for('EchoFixture')
+        self.assertEqual(aliases['staticEcho'], 'static_echo')
+        self.assertEqual(list(context.aliases.keys()), ['EchoFixture'])
+
+    def test_reimport_discards_aliases(self):
+        context = execution.ExecutionContext()
+        context.import_path('waferslim.tests.fixtures')
+        context.aliases_for('EchoFixture')
+        context.import_path('waferslim.tests.fixtures')
+        self.assertFalse('EchoFixture' in context.aliases)
+
+
+class ModuleCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        self.cache = execution.ModuleCache()
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(sys.modules.pop, 'cached_fixture', None)
+        self.path = os.path.join(directory, 'cached_fixture.py')
+        self.write_fixture('LOADS = []\nLOADS.append(1)\n', 1000)
+
+    def write_fixture(self, source, mtime):
+        with open(self.path, 'w') as fixture:
+            fixture.write(source)
+        os.utime(self.path, (mtime, mtime))
+
+    def test_module_executed_once(self):
+        module = self.cache.load('cached_fixture', self.path)
+        self.assertTrue(self.cache.load('cached_fixture', self.path)
+                        is module)
+        self.assertEqual(module.LOADS, [1])
+        self.assertTrue(sys.modules['cached_fixture'] is module)
+
+    def test_modified_module_executed_again(self):
+        module = self.cache.load('cached_fixture', self.path)
+        self.write_fixture('LOADS = [2]\n', 2000)
+        self.assertEqual(self.cache.load('cached_fixture', self.path).LOADS,
+                         [2])
+
+    def test_invalidate(self):
+        module = self.cache.load('cached_fixture', self.path)
+        self.cache.invalidate(self.path)
+        self.assertFalse(self.cache.load('cached_fixture', self.path)
+                         is module)
+
+
+class FixtureCacheTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(sys.modules.pop, 'edited_fixture', None)
+        sys.path.insert(0, directory)
+        self.addCleanup(sys.path.remove, directory)
+        self.path = os.path.join(directory, 'edited_fixture.py')
+        self.write_fixture('v1', 1000)
+        self.cache = execution.FixtureCache()
+
+    def write_fixture(self, version, mtime):
+        with open(self.path, 'w') as fixture:
+            fixture.write('class Edited(object):\n'
+                          '    VERSION = %r\n' % version)
+        os.utime(self.path, (mtime, mtime))
+
+    def version(self):
+        classes = dict(self.cache.load_classes('edited_fixture'))
+        return classes['Edited'].VERSION
+
+    def test_unmodified_classes_cached(self):
+        classes = self.cache.load_classes('edited_fixture')
+        self.assertTrue(self.cache.load_classes('edited_fixture') is classes)
+
+    def test_modified_module_loaded_again(self):
+        self.assertEqual(self.version(), 'v1')
+        self.write_fixture('v2', 2000)
+        self.assertEqual(self.version(), 'v2')
+
+    def test_invalidated_module_loaded_again(self):
+        classes = self.cache.load_classes('edited_fixture')
+        execution.MODULE_CACHE.invalidate(self.path)
+        self.assertFalse(self.cache.load_classes('edited_fixture') is classes)
+
+
+class FixtureSnapshotTestCase(unittest.TestCase):
+    def setUp(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        self.addCleanup(sys.modules.pop, 'snapshot_fixture', None)
+        self.path = os.path.join(directory, 'snapshot_fixture.py')
+        with open(self.path, 'w') as fixture:
+            fixture.write('from datetime import date\n'
+                          'class Snapshotted(object):\n'
+                          '    def say_hello(self):\n'
+                          '        return "hello"\n')
+        self.snapshot_path = os.path.join(directory, 'snapshot.json')
+
+    def load_classes(self):
+        cache = execution.ModuleCache(
+            execution.FixtureSnapshot(self.snapshot_path))
+        module = cache.load('snapshot_fixture', self.path)
+        classes = cache.classes_of(module)
+        cache.save_snapshot()
+        return cache, classes
+
+    def test_warm_start_skips_introspection(self):
+        self.load_classes()
+        self.assertTrue(os.path.exists(self.snapshot_path))
+        original = execution.find_classes
+        def not_expected(module):
+            self.fail('module introspected despite snapshot')
+        execution.find_classes = not_expected
+        self.addCleanup(setattr, execution, 'find_classes', original)
+        cache, classes = self.load_classes()
+        self.assertEqual([name for name, _ in classes],
+                         ['Snapshotted', 'date'])
+        self.assertEqual(cache.aliases_of(classes[0][1])['sayHello'],
+                         'say_hello')
+
+    def test_imported_classes_not_introspected(self):
+        introspected = []
+        original = execution.get_methods
+        def recording(Class):
+            introspected.append(Class.__name__)
+            return original(Class)
+        execution.get_methods = recording
+        self.addCleanup(setattr, execution, 'get_methods', original)
+        self.load_classes()
+        self.assertEqual(introspected, ['Snapshotted'])
+
+    def test_modified_module_introspected_again(self):
+        self.load_classes()
+        with open(self.path, 'a') as fixture:
+            fixture.write('class Added(object):\n    pass\n')
+        os.utime(self.path, (1000, 1000))
+        names = [name for name, _ in self.load_classes()[1]]
+        self.assertEqual(names, ['Added', 'Snapshotted', 'date'])
+
+
+class SysPathIndexTestCase(unittest.TestCase):
+    def setUp(self):
+        self.index = execution.SysPathIndex()
+
+    def test_finds_same_paths_as_probing(self):
+        for path in ('waferslim.tests.fixtures',
+                     'waferslim.tests.fixtures.echo_fixture',
+                     'waferslim.no_such_module'):
+            self.assertEqual(self.index.find(path),
+                             self.index._probe(path.replace('.', '/'))[0])
+
+    def test_repeated_lookup_avoids_probes(self):
+        path = 'waferslim.tests.fixtures.echo_fixture'
+        found = self.index.find(path)
+        probes = self.index.stats()['probes']
+        self.assertEqual(self.index.find(path), found)
+        stats = self.index.stats()
+        self.assertEqual(stats['probes'], probes)
+        self.assertEqual(stats['lookups'], 2)
+        self.assertTrue(stats['probes_avoided'] > 0)
+
+    def test_sys_path_change_rebuilds_index(self):
+        path = 'waferslim.tests.fixtures'
+        self.assertFalse(self.index.find(path) is None)
+        original = sys.path[:]
+        self.addCleanup(setattr, sys, 'path', original)
+        sys.path[:] = []
+        self.assertEqual(self.index.find(path), None)
+
+    def test_added_path_found_after_miss(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        original = sys.path[:]
+        self.addCleanup(setattr, sys, 'path', original)
+        sys.path.insert(0, directory)
+        self.assertEqual(self.index.find('added_fixture'), None)
+        added = os.path.join(directory, 'added_fixture.py')
+        open(added, 'w').close()
+        self.assertEqual(self.index.find('added_fixture'), added)
+
+
+class Rendezvous(object):
+    ''' Lets each of a number of threads wait until all have arrived '''
+    def __init__(self, parties):
+        self._parties = parties
+        self._arrived = 0
+        self._lock = threading.Lock()
+        self._all_arrived = threading.Event()
+
+    def arrive(self, timeout=2):
+        with self._lock:
+            self._arrived += 1
+            if self._arrived == self._parties:
+                self._all_arrived.set()
+        self._all_arrived.wait(timeout)
+        return self._all_arrived.is_set()
+
+
+@execution.parallel_calls
+class SlowFixture(object):
+    rendezvous = None
+
+    def __init__(self):
+        self.calls = []
+
+    def slow_echo(self, value):
+        time.sleep(0.2)
+        self.calls.append(value)
+        return value
+
+    def meet(self, value):
+        return SlowFixture.rendezvous.arrive() and value or 'alone'
+
+    def truth(self):
+        return True
+
+
+@unittest.skipIf(execution.ThreadPoolExecutor is None,
+                 'parallel calls need concurrent.futures')
+class ParallelCallsTestCase(ExecuteInstructions, unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.context.classes['SlowFixture'] = SlowFixture
+        for name in ('first', 'second', 'third', 'fourth'):
+            self.context.store_instance(name, SlowFixture())
+
+    def test_independent_calls_run_concurrently(self):
+        SlowFixture.rendezvous = Rendezvous(4)
+        self.assertEqual(
+            self.execute(['1', 'call', 'first', 'meet', 'a'],
+                         ['2', 'call', 'second', 'meet', 'b'],
+                         ['3', 'call', 'third', 'meet', 'c'],
+                         ['4', 'call', 'fourth', 'meet', 'd']),
+            [['1', 'a'], ['2', 'b'], ['3', 'c'], ['4', 'd']]
+        )
+
+    def test_dependent_calls_run_in_order(self):
+        self.assertEqual(
+            self.execute(['1', 'callAndAssign', 'x', 'first', 'slowEcho', 'a'],
+                         ['2', 'call', 'second', 'slowEcho', '$x!'],
+                         ['3', 'call', 'first', 'slowEcho', 'b']),
+            [['1', 'a'], ['2', 'a!'], ['3', 'b']]
+        )
+        self.assertEqual(self.context.get_instance('first').calls,
+                         ['a', 'b'])
+
+    def test_session_converters_used(self):
+        original = converters.converter_for(bool)
+        self.addCleanup(converters.register_converter, bool, original)
+        converters.register_converter(bool, converters.YesNoConverter())
+        self.assertEqual(self.execute(['1', 'call', 'first', 'truth']),
+                         [['1', 'yes']])
+
+
+@unittest.skipIf(sys.version_info < (3, 5), 'coroutines need 3.5+')
+class CoroutineCallsTestCase(ExecuteInstructions, unittest.TestCase):
+    def setUp(self):
+        self.context = execution.ExecutionContext()
+        self.addCleanup(self.context.close)
+        # async def fixtures are kept apart, as a SyntaxError before 3.5
+        self.context.import_path('waferslim.tests.coroutine_fixtures')
+        for name in ('first', 'second', 'third'):
+            self.context.store_instance(
+                name, self.context.get_type('CoroutineFixture')())
+
+    def test_independent_calls_gathered(self):
+        self.context.get_type('CoroutineFixture').meeting = 3
+        self.assertEqual(
+            self.execute(['1', 'call', 'first', 'meet', 'a'],
+                         ['2', 'call', 'second', 'meet', 'b'],
+                         ['3', 'call', 'third', 'meet', 'c']),
+            [['1', 'a'], ['2', 'b'], ['3', 'c']]
+        )
+
+    def test_dependent_calls_run_in_order(self):
+        self.assertEqual(
+            self.execute(['1', 'callAndAssign', 'x', 'first', 'slowEcho', 'a'],
+                         ['2', 'call', 'second', 'slowEcho', '$x!'],
+                         ['3', 'call', 'first', 'slowEcho', 'b']),
+            [['1', 'a'], ['2', 'a!'], ['3', 'b']]
+        )
+        self.assertEqual(self.context.get_instance('first').calls,
+                         ['a', 'b'])
+
+    def test_event_loop_kept_for_session(self):
+        first = self.execute(['1', 'call', 'first', 'eventLoop'])
+        second = self.execute(['1', 'call', 'second', 'eventLoop'])
+        self.assertFalse(first[0][1].startswith('__EXCEPTION__'))
+        self.assertEqual(first, second)
+
+
+class ResultsTestCase(unittest.TestCase):
+    def setUp(self):
+        self.results = execution.Results()
+        for row in (['id_1', 'call', 'a', 'b'], ['id_2', 'make', 'a', 'B']):
+            instruction = execution.instruction_for(row)
+            self.results.completed(instruction, 'x')
+        self.results.failed(instruction, 'cause')
+
+    def test_collection(self):
+        self.assertEqual(self.results.collection(),
+                         [['id_1', 'x'], ['id_2', 'x'],
+                          ['id_2', '__EXCEPTION__: message:<<cause>>']])
+
+    def test_view_packs_like_collection(self):
+        view = self.results.view()
+        self.assertEqual(len(view), 3)
+        self.assertEqual(view, self.results.collection())
+        self.assertEqual(protocol.pack_message(view),
+                         protocol.pack_message(self.results.collection()))
+
+    def test_instruction_for_reuses_params(self):
+        row = ['id_1', 'call', 'a', 'b']
+        instruction = execution.instruction_for(row)
+        self.assertEqual(instruction.instruction_id(), 'id_1')
+        self.assertTrue(instruction._params is row)
+        self.assertEqual(row, ['a', 'b'])
+        self.assertFalse(hasattr(instruction, '__dict__'))
+
+
+class StreamingResultsTestCase(unittest.TestCase):
+    def collect(self, results):
+        for i in range(50):
+            results.completed(execution.instruction_for(
+                ['id_%s' % i, 'call', 'a', 'b']), u'r\xe9sult %s' % i)
+        results.failed(execution.instruction_for(['id_x', 'x']), 'cause')
+        return results
+
+    def assert_streamed(self):
+        expected = protocol.pack_message(
+            self.collect(execution.Results()).collection())
+        streamed = self.collect(protocol.StreamingResults())
+        self.assertEqual(len(streamed), 51)
+        self.assertEqual(b''.join(bytes(c) for c in streamed.chunks()),
+                         bytes(expected))
+
+    def test_streamed_in_memory(self):
+        self.assert_streamed()
+
+    def test_streamed_from_spill_file(self):
+        self.addCleanup(setattr, protocol, 'SPILL_THRESHOLD',
+                        protocol.SPILL_THRESHOLD)
+        protocol.SPILL_THRESHOLD = 100
+        self.assert_streamed()
+
+    def test_collected_as_usual_for_other_encodings(self):
+        self.addCleanup(setattr, protocol, 'BYTE_ENCODING',
+                        protocol.BYTE_ENCODING)
+        protocol.BYTE_ENCODING = 'utf-16'
+        results = self.collect(protocol.StreamingResults())
+        self.assertEqual(len(results), 51)
+        self.assertEqual(repr(results), '<StreamingResults: 51 results>')
+        self.assertEqual(list(results.view()),
+                         list(self.collect(execution.Results()).view()))
+
+
+class UnpackTestCase(unittest.TestCase):
+    packed = ('[000002:000047:[000003:000005:id_01:000004:make:000005:'
+              'hello:]:000009:[000000:]:]')
+
+    def test_unpack_nested(self):
+        self.assertEqual(
+            protocol.unpack(self.packed),
+            [['id_01', 'make', 'hello'], '[000000:]']
+        )
+
+    def test_unpack_bytes_matches_unpack(self):
+        self.assertEqual(
+            protocol.unpack_bytes(self.packed.encode('utf-8')),
+            protocol.unpack(self.packed)
+        )
+        non_ascii = u'[000001:000004:caf\xe9:]'
+        self.assertEqual(
+            protocol.unpack_bytes(non_ascii.encode('utf-8')),
+            [u'caf\xe9']
+        )
+
+    def test_unpack_malformed(self):
+        for malformed in ('000001:000001:a:]',
+                          '[000001:000001:a:',
+                          '[000001:000009:a:]',
+                          '[00000x:000001:a:]'):
+            self.assertRaises(protocol.UnpackingError,
+                              protocol.unpack_bytes,
+                              malformed.encode('utf-8'))
+
+
+class PackTestCase(unittest.TestCase):
+    results = [['id_01', 'OK'], ['id_02', u'caf\xe9'],
+               ['id_03', ['', ['nested']]], []]
+
+    def test_pack_bytes_matches_pack(self):
+        self.assertEqual(
+            protocol.pack_bytes(self.results),
+            protocol.pack(self.results).encode('utf-8')
+        )
+
+    def test_pack_message_adds_byte_length(self):
+        packed = protocol.pack(self.results).encode('utf-8')
+        self.assertEqual(
+            protocol.pack_message(self.results),
+            ('%06d:' % len(packed)).encode('utf-8') + packed
+        )
+
+    def test_pack_round_trip(self):
+        self.assertEqual(
+            protocol.unpack_bytes(protocol.pack_bytes(self.results)),
+            self.results[:3] + ['[000000:]']
+        )
+
+    def test_pack_rejects_non_strings(self):
+        self.assertRaises(TypeError, protocol.pack_bytes, [1])
+
+
+class RequestReaderTestCase(unittest.TestCase):
+    def setUp(self):
+        self.sender, receiver = socket.socketpair()
+        self.addCleanup(self.sender.close)
+        self.addCleanup(receiver.close)
+        self.reader = protocol.RequestReader(receiver, buffer_size=16)
+
+    def test_read_keeps_leftover_bytes(self):
+        self.sender.sendall(b'000003:bye000005:hello')
+        self.assertEqual(self.reader.read(7), b'000003:')
+        self.assertEqual(self.reader.read(3), b'bye')
+        self.assertEqual(self.reader.read(7), b'000005:')
+        self.assertEqual(self.reader.read(5), b'hello')
+
+    def test_read_larger_than_buffer(self):
+        self.sender.sendall(b'x' * 40 + b'next')
+        self.assertEqual(self.reader.read(12), b'x' * 12)
+        self.assertEqual(self.reader.read(28), b'x' * 28)
+        self.assertEqual(self.reader.read(4), b'next')
+
+    def test_read_after_close(self):
+        self.sender.sendall(b'abc')
+        self.sender.close()
+        self.assertRaises(EOFError, self.reader.read, 4)
+
+
+def make_options(**overrides):
+    values = dict(inethost='127.0.0.1', port=0, verbose=False, threads=2,
+                  persistent=False)
+    values.update(overrides)
+    return optparse.Values(values)
+
+
+class SlimClient(object):
+    ''' Minimal Slim client, sending messages to a running server '''
+    def __init__(self, address):
+        self.socket = socket.create_connection(address)
+        self.file = self.socket.makefile('rb')
+        self.version = self.file.readline()
+
+    def call(self, *instructions):
+        message = protocol.pack([list(each) for each in instructions])
+        self.send(message.encode('utf-8'))
+        length = int(self.file.read(7)[:6])
+        return protocol.unpack_bytes(self.file.read(length))
+
+    def send(self, message_bytes):
+        header = ('%06d:' % len(message_bytes)).encode('utf-8')
+        self.socket.sendall(header + message_bytes)
+
+    def close(self):
+        self.send(b'bye')
+        self.file.close()
+        self.socket.close()
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio server needs 3.7+')
+class AsyncSlimServerTestCase(unittest.TestCase):
+    def setUp(self):
+        from waferslim.asyncio_server import AsyncSlimServer
+        self.server = AsyncSlimServer(make_options())
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.stop)
+        self.server.started.wait(5)
+
+    def test_concurrent_sessions_have_own_context(self):
+        first = SlimClient(self.server.server_address)
+        second = SlimClient(self.server.server_address)
+        self.assertEqual(first.version, b'Slim -- V0.3\n')
+        self.assertEqual(
+            first.call(['i', 'import', 'waferslim.tests.fixtures'],
+                       ['m', 'make', 'echoer', 'EchoFixture'],
+                       ['c', 'call', 'echoer', 'echo', 'first']),
+            [['i', 'OK'], ['m', 'OK'], ['c', 'first']]
+        )
+        self.assertEqual(
+            second.call(['c', 'call', 'echoer', 'echo', 'second']),
+            [['c', '__EXCEPTION__: message:<<NO_INSTANCE echoer>>']]
+        )
+        self.assertEqual(
+            first.call(['c', 'call', 'echoer', 'echo', 'again']),
+            [['c', 'again']]
+        )
+        first.close()
+        second.close()
+
+
+class ClosingContext(execution.ExecutionContext):
+    closed = 0
+
+    def close(self):
+        execution.ExecutionContext.close(self)
+        ClosingContext.closed += 1
+
+
+class DroppedSessionTestCase(unittest.TestCase):
+    def test_context_closed_when_connection_drops(self):
+        responder = protocol.RequestResponder()
+        responder.request, client = socket.socketpair()
+        self.addCleanup(responder.request.close)
+        self.addCleanup(client.close)
+        client.sendall(b'000010:ab')
+        client.shutdown(socket.SHUT_WR)
+        ClosingContext.closed = 0
+        self.assertRaises(EOFError, responder.respond_to_request,
+                          execution_context=ClosingContext)
+        self.assertEqual(ClosingContext.closed, 1)
+
+    def test_session_reported_when_connection_drops(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        report_path = os.path.join(directory, 'report.json')
+        def instrumented_context():
+            return execution.ExecutionContext(
+                instrumentation=instrumentation.Instrumentation(report_path))
+        responder = protocol.RequestResponder()
+        responder.request, client = socket.socketpair()
+        self.addCleanup(responder.request.close)
+        self.addCleanup(client.close)
+        client.shutdown(socket.SHUT_WR)
+        self.assertRaises(EOFError, responder.respond_to_request,
+                          execution_context=instrumented_context)
+        with open(report_path) as report_file:
+            self.assertEqual(len(report_file.readlines()), 1)
+
+
+@unittest.skipIf(sys.version_info < (3, 7), 'asyncio server needs 3.7+')
+class AsyncSlimServerStopTestCase(unittest.TestCase):
+    def test_stop_ends_active_sessions(self):
+        from waferslim.asyncio_server import AsyncSlimServer
+        ClosingContext.closed = 0
+        slim_server = AsyncSlimServer(make_options(),
+                                      execution_context=ClosingContext)
+        thread = threading.Thread(target=slim_server.serve_forever)
+        thread.start()
+        slim_server.started.wait(5)
+        client = SlimClient(slim_server.server_address)
+        self.assertEqual(
+            client.call(['i', 'import', 'waferslim.tests.fixtures']),
+            [['i', 'OK']])
+        slim_server.stop()
+        thread.join(10)
+        self.assertFalse(thread.is_alive())
+        self.assertEqual(ClosingContext.closed, 1)
+        self.assertEqual(client.file.read(), b'')
+        client.file.close()
+        client.socket.close()
+
+
+class WaferSlimServerTestCase(unittest.TestCase):
+    def test_shuts_down_after_session(self):
+        slim_server = server.WaferSlimServer(make_options())
+        thread = slim_server.start()
+        client = SlimClient(slim_server.server_address)
+        self.assertEqual(client.call(['i', 'import', 'waferslim.tests.fixtures']),
+                         [['i', 'OK']])
+        client.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+        slim_server.stop()
+
+    def test_serve_again_after_shutdown(self):
+        slim_server = server.WaferSlimServer(make_options())
+        self.addCleanup(slim_server.server_close)
+        slim_server.start()
+        slim_server.shutdown()
+        slim_server._thread.join(5)
+        selects = []
+        original = server._select
+        def counting_select(waiting_on, timeout):
+            selects.append(timeout)
+            return original(waiting_on, timeout)
+        server._select = counting_select
+        self.addCleanup(setattr, server, '_select', original)
+        thread = slim_server.start()
+        time.sleep(0.2)
+        self.assertTrue(len(selects) < 5)
+        client = SlimClient(slim_server.server_address)
+        self.assertEqual(client.call(['i', 'import', 'waferslim.tests.fixtures']),
+                         [['i', 'OK']])
+        client.close()
+        thread.join(5)
+        self.assertFalse(thread.is_alive())
+
+    def test_stop_without_session(self):
+        slim_server = server.WaferSlimServer(make_options())
+        thread = slim_server.start()
+        slim_server.stop()
+        self.assertFalse(thread.is_alive())
+
+
+class InstrumentationTestCase(unittest.TestCase):
+    def test_session_report_written(self):
+        directory = tempfile.mkdtemp()
+        self.addCleanup(shutil.rmtree, directory)
+        report_path = os.path.join(directory, 'report.json')
+        slim_server = server.WaferSlimServer(make_options(
+            instrument=report_path, profile='EchoFixture.echo'))
+        thread = slim_server.start()
+        client = SlimClient(slim_server.server_address)
+        client.call(['i', 'import', 'waferslim.tests.fixtures'],
+                    ['m', 'make', 'echoer', 'EchoFixture'],
+                    ['c1', 'call', 'echoer', 'echo', 'hello'],
+                    ['c2', 'call', 'echoer', 'echo', 'there'])
+        client.close()
+        thread.join(5)
+        slim_server.stop()
+
+        with open(report_path) as report_file:
+            report = json.loads(report_file.readline())
+        for phase in ('recv', 'unpack', 'execute', 'send'):
+            self.assertEqual(report['phases'][phase]['count'], 1)
+        # streamed results are packed as they are collected, under execute
+        self.assertEqual(report['phases']['pack']['count'], 0)
+        self.assertTrue(report['phases']['recv']['bytes'] > 0)
+        instructions = report['instructions']
+        self.assertEqual(instructions['by_type']['Call']['count'], 2)
+        self.assertEqual(instructions['by_class']['EchoFixture']['count'], 3)
+        self.assertEqual(
+            instructions['by_method']['EchoFixture.echo']['count'], 2)
+        self.assertTrue(report['profile'])
+
+
+class PersistentServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = server.WaferSlimServer(make_options(persistent=True))
+        self.server.start()
+        self.addCleanup(self.server.stop)
+
+    def test_serves_sessions_with_shared_fixtures(self):
+        for session in ('first', 'second'):
+            client = SlimClient(self.server.server_address)
+            self.assertEqual(
+                client.call(['i', 'import', 'waferslim.tests.fixtures'],
+                            ['m', 'make', 'echoer', 'EchoFixture'],
+                            ['c', 'call', 'echoer', 'echo', session]),
+                [['i', 'OK'], ['m', 'OK'], ['c', session]]
+            )
+            client.close()
+        cache = self.server.fixture_cache
+        self.assertTrue(cache.load_classes('waferslim.tests.fixtures')
+                        is cache.load_classes('waferslim.tests.fixtures'))
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), 'pre-fork server needs os.fork')
+class PreForkServerTestCase(unittest.TestCase):
+    def setUp(self):
+        self.server = server.PreForkSlimServer(make_options(
+            workers=2, preload='waferslim.tests.fixtures'))
+        thread = threading.Thread(target=self.server.serve_forever)
+        thread.start()
+        self.addCleanup(self.server.server_close)
+        self.addCleanup(thread.join)
+        self.addCleanup(self.server.shutdown)
+
+    def test_workers_serve_concurrent_sessions(self):
+        clients = [SlimClient(self.server.server_address) for i in range(2)]
+        for number, client in enumerate(clients):
+            self.assertEqual(
+                client.call(['i', 'import', 'waferslim.tests.fixtures'],
+                            ['m', 'make', 'echoer', 'EchoFixture'],
+                            ['c', 'call', 'echoer', 'echo', str(number)]),
+                [['i', 'OK'], ['m', 'OK'], ['c', str(number)]]
+            )
+        for client in clients:
+            client.close()
+        self.assertEqual(len(self.server._worker_pids), 2)
+
+
+@unittest.skipIf(not hasattr(os, 'fork'), 'pre-fork server needs os.fork')
+class PreForkWorkersTestCase(unittest.TestCase):
+    def test_worker_reaped_elsewhere_is_dropped(self):
+        pid = os.fork()
+        if not pid:
+            os._exit(0)
+        os.waitpid(pid, 0)
+        prefork = server.PreForkSlimServer.__new__(server.PreForkSlimServer)
+        prefork._worker_pids = set([pid])
+        self.assertEqual(prefork._exited_workers(), [(pid, None)])
+
+
 if __name__ == '__main__':
     unittest.main()